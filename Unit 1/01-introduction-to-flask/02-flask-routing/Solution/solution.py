@@ -1,44 +1,176 @@
 # Import a class named Flask from flask library
-from flask import Flask
+from flask import Flask, jsonify, make_response, request
+from werkzeug.exceptions import BadRequest
+from werkzeug.routing import BaseConverter, ValidationError
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+import atexit
+
+from solution_calculator import OPERATIONS, CalculationTimeout, Calculator
 
 # Create instance of Flask class
 app = Flask(__name__)
 
+# Calculator mode: 'float' divides with /, 'exact' keeps arbitrary precision
+app.config['CALCULATOR_MODE'] = 'float'
+
+# Bound the responses kept in memory to about 1 MB of body
+app.config['RESPONSE_CACHE_MAX_SIZE'] = 2 ** 20
+
+# Limit operands to 4000 digits and slow calculations to one second
+# Results longer than the operand limit are shown in scientific notation
+app.config['CALCULATOR_MAX_DIGITS'] = 4000
+app.config['CALCULATOR_POOL_DIGITS'] = 1000
+app.config['CALCULATOR_TIME_BUDGET'] = 1.0
+
+calculator_lock = Lock()
+
+
+def get_calculator():
+    # Built from the configuration on first use, so settings changed after
+    # import apply, e.g. by tests or before app.run()
+    with calculator_lock:
+        if 'calculator' not in app.extensions:
+            app.extensions['calculator'] = Calculator(app.config['CALCULATOR_MAX_DIGITS'],
+                                                      app.config['CALCULATOR_POOL_DIGITS'],
+                                                      app.config['CALCULATOR_TIME_BUDGET'])
+        return app.extensions['calculator']
+
+
+@atexit.register
+def close_calculator():
+    # Stop the pool's worker processes, the next calculation builds a new
+    # calculator from the configuration
+    with calculator_lock:
+        calculator = app.extensions.pop('calculator', None)
+    if calculator is not None:
+        calculator.close()
+
+
+class OperationConverter(BaseConverter):
+    # Matches registered operations, other names give 404 Not Found
+    regex = '[a-z_]+'
+
+    def to_python(self, value):
+        if value not in OPERATIONS['float']:
+            raise ValidationError()
+        return value
+
 
-# Accept two numbers using the two path segments after add
-@app.route('/add/<int:n1>/<int:n2>')
-def add(n1, n2):
-    # Add n1 and n2 and send the result to the site visitor
-    return str(n1 + n2)
+class NumberConverter(BaseConverter):
+    # Like int, but rejects operands too long to calculate with quickly
+    regex = r'\d+'
 
+    def to_python(self, value):
+        max_digits = app.config['CALCULATOR_MAX_DIGITS']
+        if len(value) > max_digits:
+            raise BadRequest("Numbers may have at most %d digits" % max_digits)
+        return int(value)
 
-@app.route('/subtract/<int:n1>/<int:n2>')
-def subtract(n1, n2):
-    return str(n1 - n2)
 
+app.url_map.converters['operation'] = OperationConverter
+app.url_map.converters['number'] = NumberConverter
 
-@app.route('/multiply/<int:n1>/<int:n2>')
-def multiply(n1, n2):
-    return str(n1 * n2)
 
+class ResponseCache(object):
+    """LRU cache of the responses of pure views, bounded by total body length
 
-@app.route('/divide/<int:n1>/<int:n2>')
-def divide(n1, n2):
-    return str(n1 / n2)
+    Responses are keyed by path and calculator mode, so only views whose
+    response depends on nothing else may be cached.
+    """
 
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+        self._lock = Lock()
 
-@app.route('/math/<operation>/<int:n1>/<int:n2>')
+    def get(self, key):
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def set(self, key, body, mimetype):
+        with self._lock:
+            if key in self._responses:
+                self.size -= len(self._responses.pop(key)[0])
+            self._responses[key] = (body, mimetype)
+            self.size += len(body)
+            # Evict the least recently used responses
+            while self.size > self.max_size and self._responses:
+                self.size -= len(self._responses.popitem(last=False)[1][0])
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+            self.size = self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': len(self._responses),
+            'size': self.size,
+        }
+
+    def cached(self, max_age=31536000):
+        # Decorator for pure views, proxies may also keep their 200 OK
+        # responses for max_age, errors such as timeouts are never stored
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (request.path, app.config['CALCULATOR_MODE'])
+                cached = self.get(key)
+                if cached is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code == 200:
+                        self.set(key, response.get_data(), response.mimetype)
+                    response.headers['X-Cache'] = 'MISS'
+                else:
+                    response = app.response_class(cached[0], mimetype=cached[1])
+                    response.headers['X-Cache'] = 'HIT'
+                if response.status_code == 200:
+                    response.headers['Cache-Control'] = 'public, max-age=%d' % max_age
+                else:
+                    response.headers['Cache-Control'] = 'no-store'
+                return response
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_MAX_SIZE'])
+
+
+# Accept an operation and two numbers from the path, e.g. /add/2/2
+# or /math/add/2/2, in one view for all operations
+@app.route('/<operation:operation>/<number:n1>/<number:n2>')
+@app.route('/math/<operation:operation>/<number:n1>/<number:n2>')
+@response_cache.cached()
 def math(operation, n1, n2):
-    if operation == "add":
-        return str(n1 + n2)
-    if operation == "subtract":
-        return str(n1 - n2)
-    if operation == "multiply":
-        return str(n1 * n2)
-    if operation == "divide":
-        return str(n1 / n2)
-    else:
-        return "Operation not supported"
+    # Calculate and send the result to the site visitor
+    try:
+        return get_calculator().calculate(operation, n1, n2, app.config['CALCULATOR_MODE'])
+    except CalculationTimeout:
+        return "Calculation took too long", 503
+
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(response_cache.stats())
 
 
 # Allows app to be run with python3 file_name.py
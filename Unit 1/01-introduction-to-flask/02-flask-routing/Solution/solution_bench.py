@@ -0,0 +1,81 @@
+# Per-request overhead of the calculator routes: python3 solution_bench.py
+import timeit
+
+from flask import Flask
+
+from solution import app, response_cache
+
+# Mostly small numbers, and one product whose decimal formatting is costly
+PATHS = ['/add/2/2', '/math/subtract/20/2', '/math/multiply/2/20', '/divide/2/2',
+         '/math/divide/7/3', '/math/add/123456789/987654321',
+         '/multiply/%s/%s' % ('9' * 2100, '9' * 2100)]
+
+
+def legacy_app():
+    # The calculator before the operation registry: five routes and an if chain
+    legacy = Flask(__name__)
+
+    @legacy.route('/add/<int:n1>/<int:n2>')
+    def add(n1, n2):
+        return str(n1 + n2)
+
+    @legacy.route('/subtract/<int:n1>/<int:n2>')
+    def subtract(n1, n2):
+        return str(n1 - n2)
+
+    @legacy.route('/multiply/<int:n1>/<int:n2>')
+    def multiply(n1, n2):
+        return str(n1 * n2)
+
+    @legacy.route('/divide/<int:n1>/<int:n2>')
+    def divide(n1, n2):
+        return str(n1 / n2)
+
+    @legacy.route('/math/<operation>/<int:n1>/<int:n2>')
+    def math(operation, n1, n2):
+        if operation == "add":
+            return str(n1 + n2)
+        if operation == "subtract":
+            return str(n1 - n2)
+        if operation == "multiply":
+            return str(n1 * n2)
+        if operation == "divide":
+            return str(n1 / n2)
+        else:
+            return "Operation not supported"
+
+    return legacy
+
+
+def bench_app(name, flask_app, runs=10000):
+    tester = flask_app.test_client()
+    adapter = flask_app.url_map.bind('localhost')
+
+    contexts = [flask_app.test_request_context(path) for path in PATHS]
+
+    def dispatch():
+        # Routing and the view alone, without the rest of the request cycle
+        for path, context in zip(PATHS, contexts):
+            with context:
+                endpoint, args = adapter.match(path)
+                flask_app.view_functions[endpoint](**args)
+
+    def request():
+        for path in PATHS:
+            tester.get(path)
+
+    routed = timeit.timeit(dispatch, number=runs) / runs / len(PATHS)
+    full = timeit.timeit(request, number=runs // 20) / (runs // 20) / len(PATHS)
+    print("  %-9s routing + view %6.2f us   full request %6.1f us (%.0f requests per second)"
+          % (name, routed * 1e6, full * 1e6, 1 / full))
+
+
+if __name__ == '__main__':
+    print("mean per request over %d paths:" % len(PATHS))
+    bench_app('before', legacy_app())
+    response_cache.max_size = 0
+    bench_app('no cache', app)
+    response_cache.max_size = app.config['RESPONSE_CACHE_MAX_SIZE']
+    response_cache.clear()
+    bench_app('cached', app)
+    print("response cache hit rate %.3f" % response_cache.hit_rate)
@@ -0,0 +1,131 @@
+# Calculator engine: operations by name, evaluated within size and time limits
+from fractions import Fraction
+from threading import Lock
+import math
+import multiprocessing
+import operator
+import os
+
+# Operations by name for every mode, each takes two integers
+# Python integers never overflow, so only division differs between modes
+OPERATIONS = {
+    'float': {
+        'add': operator.add,
+        'subtract': operator.sub,
+        'multiply': operator.mul,
+        'divide': operator.truediv,
+    },
+}
+OPERATIONS['exact'] = dict(OPERATIONS['float'], divide=Fraction)
+
+# Builtin operations have results no larger than their operands combined
+BUILTIN = set(OPERATIONS['float'])
+
+
+def register(name, function, exact_function=None):
+    # Add an operation, e.g. register('power', operator.pow)
+    # Functions must be defined at module level to run in the process pool
+    OPERATIONS['float'][name] = function
+    OPERATIONS['exact'][name] = exact_function or function
+
+
+class CalculationTimeout(Exception):
+    pass
+
+
+def digits(n):
+    # Decimal digits of an integer, estimated without converting it
+    # The estimate is exact or one too many
+    return int(abs(n).bit_length() * math.log10(2)) + 1
+
+
+def fits(n, max_digits):
+    # Only compare with a power of ten when the estimate is not enough
+    return digits(n) <= max_digits or abs(n) < 10 ** max_digits
+
+
+def format_number(value, max_digits):
+    # Converting an integer to decimal takes quadratic time, so integers
+    # longer than max_digits are shown in scientific notation instead
+    if isinstance(value, Fraction):
+        return "%s/%s" % (format_number(value.numerator, max_digits),
+                          format_number(value.denominator, max_digits))
+    if not isinstance(value, int) or fits(value, max_digits):
+        return str(value)
+    exponent = math.log10(abs(value))
+    mantissa = "%.9f" % 10 ** (exponent % 1)
+    if mantissa.startswith('10'):
+        mantissa, exponent = "%.9f" % 1, exponent + 1
+    return "%s%se+%d" % ('-' if value < 0 else '', mantissa, exponent)
+
+
+def evaluate(function, n1, n2, max_digits):
+    return format_number(function(n1, n2), max_digits)
+
+
+class Calculator(object):
+    """Evaluates operations with bounded operands, time and output
+
+    Operands are limited to max_digits digits by the URL converter, which
+    keeps them below Python's own limit for converting strings to integers.
+    Calculations whose operands have more than pool_digits digits together,
+    and registered operations whose cost is unknown, run in a process pool.
+    One that takes longer than time_budget seconds raises CalculationTimeout
+    and the pool is terminated, stopping it instead of letting it occupy a
+    CPU. Results are formatted by format_number, also in the pool.
+
+    Call close(), or use the calculator in a with block, to stop the
+    pool's worker processes.
+    """
+
+    def __init__(self, max_digits=4000, pool_digits=1000, time_budget=1.0, processes=2):
+        self.max_digits = max_digits
+        self.pool_digits = pool_digits
+        self.time_budget = time_budget
+        self.processes = processes
+        self._pool = None
+        self._pid = None
+        self._lock = Lock()
+
+    def calculate(self, name, n1, n2, mode='float'):
+        function = OPERATIONS[mode][name]
+        if name in BUILTIN and digits(n1) + digits(n2) <= self.pool_digits:
+            return evaluate(function, n1, n2, self.max_digits)
+        pool = self._get_pool()
+        result = pool.apply_async(evaluate, (function, n1, n2, self.max_digits))
+        try:
+            return result.get(self.time_budget)
+        except multiprocessing.TimeoutError:
+            self._terminate(pool)
+            raise CalculationTimeout("%s took longer than %s seconds" % (name, self.time_budget))
+
+    def _get_pool(self):
+        # Pools do not survive fork, so every worker process starts its own
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = multiprocessing.Pool(self.processes)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _terminate(self, pool):
+        # Kill the runaway calculation, the next one starts a new pool
+        # Other calculations on the same pool time out and fail as well
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
+        pool.join()
+
+    def close(self):
+        # Stop and wait for the worker processes of this process's pool
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.terminate()
+            pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,8 +1,28 @@
-from solution import app
+from solution import app, close_calculator, response_cache
+from solution_calculator import OPERATIONS, Calculator, register
+import multiprocessing
+import operator
+import time
 import unittest
 
+
+def slow(n1, n2):
+    time.sleep(n1)
+    return n2
+
 class TestCalculator(unittest.TestCase):
 
+    @classmethod
+    def tearDownClass(cls):
+        close_calculator()
+
+    def register(self, *args):
+        # Register an operation for this test only
+        saved = {mode: dict(operations) for mode, operations in OPERATIONS.items()}
+        self.addCleanup(response_cache.clear)
+        self.addCleanup(OPERATIONS.update, saved)
+        register(*args)
+
     def test_add(self):
         tester = app.test_client(self)
         response = tester.get('/add/2/2', content_type='html/text')
@@ -45,6 +65,100 @@ class TestCalculator(unittest.TestCase):
         self.assertIn(b'1', response.data)
         self.assertEqual(response.status_code, 200)
 
+    def test_operation_registry(self):
+        tester = app.test_client(self)
+        response = tester.get('/math/power/2/2', content_type='html/text')
+        self.assertEqual(response.status_code, 404)
+        # math is the optional prefix, not an operation
+        response = tester.get('/math/2/2', content_type='html/text')
+        self.assertEqual(response.status_code, 404)
+
+        self.register('power', operator.pow)
+        response = tester.get('/math/power/2/10', content_type='html/text')
+        self.assertEqual(response.data, b'1024')
+        response = tester.get('/power/2/10', content_type='html/text')
+        self.assertEqual(response.data, b'1024')
+
+    def test_exact_mode(self):
+        tester = app.test_client(self)
+        response = tester.get('/divide/1/3', content_type='html/text')
+        self.assertEqual(response.data, str(1 / 3).encode())
+
+        app.config['CALCULATOR_MODE'] = 'exact'
+        try:
+            response = tester.get('/divide/1/3', content_type='html/text')
+            self.assertEqual(response.data, b'1/3')
+            response = tester.get('/math/divide/10000000000000000000001/10', content_type='html/text')
+            self.assertEqual(response.data, b'10000000000000000000001/10')
+        finally:
+            app.config['CALCULATOR_MODE'] = 'float'
+
+    def test_response_cache(self):
+        tester = app.test_client(self)
+        response_cache.clear()
+        response = tester.get('/multiply/6/7', content_type='html/text')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000')
+        response = tester.get('/multiply/6/7', content_type='html/text')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(response.data, b'42')
+
+        # The mode is part of the key
+        app.config['CALCULATOR_MODE'] = 'exact'
+        try:
+            self.assertEqual(tester.get('/divide/1/4').data, b'1/4')
+        finally:
+            app.config['CALCULATOR_MODE'] = 'float'
+        self.assertEqual(tester.get('/divide/1/4').data, b'0.25')
+
+        stats = tester.get('/cache-stats').get_json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 3, 3))
+        self.assertEqual(stats['hit_rate'], 0.25)
+
+        # Least recently used responses are evicted beyond max_size
+        response_cache.max_size = 5
+        tester.get('/add/1/1')
+        self.assertEqual(response_cache.stats()['entries'], 2)
+        response_cache.max_size = app.config['RESPONSE_CACHE_MAX_SIZE']
+
+    def test_large_numbers(self):
+        tester = app.test_client(self)
+        response = tester.get('/add/%s/1' % ('9' * 4001), content_type='html/text')
+        self.assertEqual(response.status_code, 400)
+
+        # Results longer than the operand limit are not written out in full
+        n = '9' * 4000
+        response = tester.get('/multiply/%s/%s' % (n, n), content_type='html/text')
+        self.assertEqual(response.data, b'1.000000000e+8000')
+        response = tester.get('/subtract/0/%s' % n, content_type='html/text')
+        self.assertEqual(response.data, b'-' + n.encode())
+
+    def test_time_budget(self):
+        tester = app.test_client(self)
+        self.register('slow', slow)
+        # The calculator is rebuilt with the new budget
+        close_calculator()
+        self.addCleanup(close_calculator)
+        self.addCleanup(app.config.__setitem__, 'CALCULATOR_TIME_BUDGET',
+                        app.config['CALCULATOR_TIME_BUDGET'])
+        app.config['CALCULATOR_TIME_BUDGET'] = 0.5
+        start = time.monotonic()
+        response = tester.get('/slow/10/1', content_type='html/text')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        self.assertLess(time.monotonic() - start, 2)
+        # The stuck calculation was stopped, new ones run on a fresh pool
+        response = tester.get('/slow/0/7', content_type='html/text')
+        self.assertEqual(response.data, b'7')
+
+    def test_close(self):
+        # Leaving the with block stops the pool's worker processes
+        with Calculator(pool_digits=0) as calculator:
+            self.assertEqual(calculator.calculate('add', 2, 2), '4')
+            workers = {process.pid for process in multiprocessing.active_children()}
+        self.assertTrue(workers)
+        self.assertFalse(workers & {process.pid for process in multiprocessing.active_children()})
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,15 +1,36 @@
 # Import Flask class, render_template function, and request object
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 
-# Make HTTP requests with Python
-import requests
+# Calculator operations by name, vectorized for /math/batch
+import solution_operations
+import solution_batch
 
-# HTML parser
-from bs4 import BeautifulSoup
+# HTML parsers, selectolax or lxml are used when installed
+from solution_parsers import get_parser
+
+# Fetch news sources concurrently with an async HTTP client
+from solution_sources import HeadlineAggregator
+
+# In-memory headline cache refreshed in the background
+from solution_headlines import HeadlineCache
 
 # Create instance of Flask class, set custom template folder
 app = Flask(__name__, template_folder="solution_templates")
 
+# Configure the news sources and how long scraped headlines stay fresh
+# Each source has a URL and a timeout in seconds
+app.config['NEWS_SOURCES'] = [
+    {'url': 'https://news.google.com', 'timeout': 10},
+]
+app.config['NEWS_TTL'] = 300
+# None picks the fastest installed parser: selectolax, lxml or html.parser
+app.config['NEWS_PARSER'] = None
+
+# Calculator mode: 'float' divides with /, 'exact' keeps arbitrary precision
+app.config['CALCULATOR_MODE'] = 'float'
+# Calculations accepted by one request to /math/batch
+app.config['BATCH_MAX_CALCULATIONS'] = solution_batch.MAX_CALCULATIONS
+
 # Part 1
 
 @app.route('/person/<name>/<age>')
@@ -28,20 +49,27 @@ def math():
     n1 = int(request.args.get('num1'))
     n2 = int(request.args.get('num2'))
     calculation = request.args.get('calculation')
-    if calculation == "add":
-        result = str(n1 + n2)
-    elif calculation == "subtract":
-        result = str(n1 - n2)
-    elif calculation == "multiply":
-        result = str(n1 * n2)
-    elif calculation == "divide":
-        try:
-            result = str(n1 / n2)
-        except ZeroDivisionError:
-            result = "Division by zero"
-    else:
+    try:
+        result = solution_operations.calculate(calculation, n1, n2, app.config['CALCULATOR_MODE'])
+    except KeyError:
         return "Error processing request"
-    return result
+    return str(result)
+
+
+@app.route('/math/batch', methods=['POST'])
+def math_batch():
+    # Many calculations per request, as JSON lists or packed binary records
+    max_calculations = app.config['BATCH_MAX_CALCULATIONS']
+    try:
+        if request.mimetype == 'application/octet-stream':
+            num1, num2, codes = solution_batch.parse_binary(request.get_data(), max_calculations)
+        else:
+            num1, num2, codes = solution_batch.parse_json(
+                request.get_json(force=True), max_calculations)
+    except ValueError as error:
+        return str(error), 400
+    results = solution_batch.evaluate(num1, num2, codes, app.config['CALCULATOR_MODE'])
+    return Response(solution_batch.stream(results), mimetype='text/plain')
 
 # Part 3
 
@@ -50,23 +78,29 @@ def home():
     return render_template("home.html")
 
 
+def parse_articles(content):
+    # Parse the raw bytes, the parser detects the encoding itself
+    parse = get_parser(app.config['NEWS_PARSER'])
+    return parse(content)
+
+
+aggregator = HeadlineAggregator(parse_articles)
+
+
+def fetch_articles():
+    # Slow or failing sources do not hold up the others
+    return aggregator.fetch(app.config['NEWS_SOURCES'])
+
+
+headlines = HeadlineCache(fetch_articles, ttl=app.config['NEWS_TTL'])
+
+
 @app.route('/results')
 def results():
-    url = 'https://news.google.com'
     keyword = request.args.get('keyword')
-    data = requests.get(url)
-    soup = BeautifulSoup(data.text, "html.parser")
-    titles = soup.select(".titletext")
-    articles = [{
-        'title': title.text,
-        'href': title.parent['href']
-    } for title in titles]
-
-    matching_articles = [
-        article
-        for article in articles
-        if keyword.lower() in article['title'].lower()
-    ]
+    # Never wait on the news sites, search the headlines scraped most recently
+    # Every word of the keyword must start a word of the title
+    matching_articles = headlines.search(keyword)
     return render_template('results.html', articles=matching_articles)
 
 
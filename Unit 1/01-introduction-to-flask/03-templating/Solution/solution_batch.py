@@ -0,0 +1,123 @@
+# Vectorized evaluation of many calculations at once for POST /math/batch
+# Results are formatted exactly like /math in the same calculator mode
+import numpy as np
+
+from solution_operations import OPERATIONS, calculate
+
+# Operation codes index the registered operations, the first four of which
+# (add, subtract, multiply, divide) are evaluated with NumPy
+VECTORIZED = 4
+
+# Compact binary body: one little-endian record per calculation
+RECORD = np.dtype([('num1', '<i8'), ('num2', '<i8'), ('operation', 'u1')])
+
+# Rows whose results could overflow 64 bit integers, or lose precision when
+# divided as floats, are computed again with Python integers
+INT_LIMIT = 2 ** 62
+FLOAT_LIMIT = 2 ** 53
+
+# Number of results sent per chunk of the streamed response
+CHUNK_SIZE = 4096
+
+# Calculations accepted by one request, unless the caller allows more
+MAX_CALCULATIONS = 100000
+
+
+def operation_names():
+    return list(OPERATIONS['float'])
+
+
+def parse_operands(values):
+    operands = np.array(values)
+    if operands.size == 0:
+        return operands.astype(np.int64)
+    if operands.ndim != 1 or operands.dtype.kind not in 'iO':
+        raise ValueError("Operands must be lists of integers")
+    if operands.dtype.kind == 'O':
+        # Integers too large for 64 bits stay Python integers
+        if not all(isinstance(n, int) for n in values):
+            raise ValueError("Operands must be lists of integers")
+    return operands
+
+
+def parse_json(data, max_calculations=MAX_CALCULATIONS):
+    # {"num1": [...], "num2": [...], "calculation": "add" or [...]}
+    try:
+        num1 = parse_operands(data['num1'])
+        num2 = parse_operands(data['num2'])
+        calculation = data['calculation']
+    except (KeyError, TypeError):
+        raise ValueError("Expected num1, num2 and calculation")
+    if not (isinstance(calculation, str) or
+            isinstance(calculation, list) and all(isinstance(name, str) for name in calculation)):
+        raise ValueError("calculation must be an operation name or a list of them")
+    if len(num1) > max_calculations:
+        raise ValueError("At most %d calculations per request" % max_calculations)
+    codes = {name: code for code, name in enumerate(operation_names())}
+    if isinstance(calculation, str):
+        codes = np.full(len(num1), codes.get(calculation, -1))
+    else:
+        codes = np.array([codes.get(name, -1) for name in calculation])
+    if not len(num1) == len(num2) == len(codes):
+        raise ValueError("num1, num2 and calculation must have the same length")
+    return num1, num2, codes
+
+
+def parse_binary(body, max_calculations=MAX_CALCULATIONS):
+    if len(body) % RECORD.itemsize:
+        raise ValueError("Body must be a sequence of %d byte records" % RECORD.itemsize)
+    if len(body) // RECORD.itemsize > max_calculations:
+        raise ValueError("At most %d calculations per request" % max_calculations)
+    records = np.frombuffer(body, dtype=RECORD)
+    return records['num1'], records['num2'], records['operation'].astype(np.int64)
+
+
+def evaluate(num1, num2, codes, mode='float'):
+    """Evaluate calculations element-wise in a calculator mode
+
+    Returns an object array holding an int, a float, a Fraction or an
+    error message for every calculation.
+    """
+    results = np.full(len(codes), "Error processing request", dtype=object)
+    for code, name in enumerate(operation_names()):
+        rows = np.flatnonzero(codes == code)
+        if not len(rows):
+            continue
+        a, b = num1[rows], num2[rows]
+        # NumPy only computes what the float mode computes, e.g. not the
+        # exact mode's divide
+        vectorized = code < VECTORIZED and OPERATIONS[mode][name] is OPERATIONS['float'][name]
+        if not vectorized or a.dtype == object or b.dtype == object:
+            # Registered operations and operands beyond 64 bits use Python
+            results[rows] = [calculate(name, n1, n2, mode)
+                             for n1, n2 in zip(a.tolist(), b.tolist())]
+            continue
+        values, unsafe = _vectorized(code, a, b)
+        results[rows] = values.tolist()
+        # Redo the few rows NumPy could get wrong with exact Python arithmetic
+        for i in np.flatnonzero(unsafe):
+            results[rows[i]] = calculate(name, int(a[i]), int(b[i]), mode)
+    return results
+
+
+def _vectorized(code, a, b):
+    if code == 3:
+        zero = b == 0
+        values = (a / np.where(zero, 1, b)).astype(object)
+        values[zero] = "Division by zero"
+        unsafe = (np.abs(a.astype(float)) > FLOAT_LIMIT) | (np.abs(b.astype(float)) > FLOAT_LIMIT)
+        return values, unsafe
+    if code == 0:
+        values, estimate = a + b, a.astype(float) + b
+    elif code == 1:
+        values, estimate = a - b, a.astype(float) - b
+    else:
+        values, estimate = a * b, a.astype(float) * b
+    return values, np.abs(estimate) >= INT_LIMIT
+
+
+def stream(results):
+    # One result per line, sent in chunks while the rest are formatted
+    for start in range(0, len(results), CHUNK_SIZE):
+        chunk = results[start:start + CHUNK_SIZE].tolist()
+        yield "\n".join(map(str, chunk)) + "\n"
@@ -0,0 +1,94 @@
+# Benchmarks for the news scraper: python3 solution_bench.py
+import os
+import random
+import timeit
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+from solution import app
+from solution_batch import operation_names
+from solution_headlines import HeadlineIndex
+from solution_parsers import PARSERS
+
+WORDS = ["weather", "rome", "japan", "election", "budget", "market", "storm",
+         "football", "science", "health", "railway", "museum", "startup",
+         "battery", "teachers", "drones", "harvest", "council", "bank", "voters"]
+
+
+def make_headlines(count, seed=1):
+    # Titles mix common words with rare made-up ones, like real headlines
+    rng = random.Random(seed)
+    headlines = []
+    for i in range(count):
+        words = rng.sample(WORDS, 4) + ["word%d" % rng.randrange(count)]
+        rng.shuffle(words)
+        headlines.append({'title': " ".join(words).capitalize(), 'href': "/articles/%d" % i})
+    return headlines
+
+
+def linear_search(articles, keyword):
+    return [article for article in articles if keyword.lower() in article['title'].lower()]
+
+
+def bench_search(count=100000, runs=20):
+    articles = make_headlines(count)
+    index = HeadlineIndex()
+    build = timeit.timeit(lambda: index.update(articles), number=1)
+    # Replace 1% of the headlines, as a refresh of the page would
+    changed = articles[count // 100:] + make_headlines(count // 100, seed=2)
+    for article in changed[-(count // 100):]:
+        article['href'] += "-new"
+    rebuild = timeit.timeit(lambda: index.update(changed), number=1)
+    print("%d headlines: index build %.3f s, incremental update (1%% changed) %.3f s"
+          % (count, build, rebuild))
+    for keyword in ["word12345", "rom", "japan election", "zzz"]:
+        linear = timeit.timeit(lambda: linear_search(changed, keyword), number=runs) / runs
+        indexed = timeit.timeit(lambda: index.search(keyword), number=runs) / runs
+        print("  %-16r %6d matches  linear %8.3f ms  index %8.3f ms"
+              % (keyword, len(index.search(keyword)), linear * 1000, indexed * 1000))
+
+
+def parse_original(content):
+    # The scraper before parsers were pluggable: decode, then html.parser
+    soup = BeautifulSoup(content.decode('utf-8'), "html.parser")
+    return [{'title': title.text, 'href': title.parent['href']}
+            for title in soup.select(".titletext")]
+
+
+def bench_parsers(runs=50):
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'solution_fixtures', 'google_news.html')
+    with open(fixture, 'rb') as f:
+        content = f.read()
+    print("parsing %d byte fixture page, mean of %d runs:" % (len(content), runs))
+    parsers = [('original', parse_original)] + [(name, parse) for name, parse in PARSERS.items() if parse]
+    for name, parse in parsers:
+        seconds = timeit.timeit(lambda: parse(content), number=runs) / runs
+        print("  %-12s %7.2f ms" % (name, seconds * 1000))
+
+
+def bench_batch(count=10000):
+    rng = np.random.default_rng(1)
+    num1 = rng.integers(-1000, 1000, count).tolist()
+    num2 = rng.integers(-1000, 1000, count).tolist()
+    calculation = [operation_names()[i] for i in rng.integers(0, 4, count)]
+    tester = app.test_client()
+
+    def one_by_one():
+        for n1, n2, name in zip(num1, num2, calculation):
+            tester.get('/math', query_string={'num1': n1, 'num2': n2, 'calculation': name})
+
+    def batch():
+        tester.post('/math/batch', json={'num1': num1, 'num2': num2, 'calculation': calculation})
+
+    single = timeit.timeit(one_by_one, number=1)
+    batched = timeit.timeit(batch, number=5) / 5
+    print("%d calculations: /math one by one %.3f s, /math/batch %.1f ms (%.0f per second)"
+          % (count, single, batched * 1000, count / batched))
+
+
+if __name__ == '__main__':
+    bench_search()
+    bench_parsers()
+    bench_batch()
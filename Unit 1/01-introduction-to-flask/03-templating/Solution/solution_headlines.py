@@ -0,0 +1,169 @@
+import bisect
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class HeadlineIndex(object):
+    """Inverted index from title words to articles
+
+    search() matches articles whose titles contain, for every word of the
+    query, a word starting with it. Its cost depends on the number of
+    distinct words sharing each prefix and on the size of the result, not
+    on the number of articles. update() only indexes the articles that
+    were added and unindexes the ones that disappeared.
+    """
+
+    def __init__(self):
+        self.articles = {}
+        self._positions = {}
+        self._postings = {}
+        self._words = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(article):
+        return (article['href'], article['title'])
+
+    def update(self, articles):
+        keys = [self._key(article) for article in articles]
+        with self._lock:
+            words = set(self._postings)
+            new_keys = set(keys)
+            for key in list(self.articles):
+                if key not in new_keys:
+                    self._remove(key)
+            for position, (key, article) in enumerate(zip(keys, articles)):
+                if key not in self.articles:
+                    self._add(key, article)
+                self._positions[key] = position
+            # Keep the sorted word list used for prefix lookups in sync
+            added = self._postings.keys() - words
+            removed = words - self._postings.keys()
+            if len(added) + len(removed) > 100:
+                self._words = sorted(self._postings)
+            else:
+                for word in removed:
+                    del self._words[bisect.bisect_left(self._words, word)]
+                for word in added:
+                    bisect.insort(self._words, word)
+
+    def _add(self, key, article):
+        self.articles[key] = article
+        for word in set(tokenize(article['title'])):
+            self._postings.setdefault(word, set()).add(key)
+
+    def _remove(self, key):
+        article = self.articles.pop(key)
+        del self._positions[key]
+        for word in set(tokenize(article['title'])):
+            posting = self._postings[word]
+            posting.discard(key)
+            if not posting:
+                del self._postings[word]
+
+    def _prefix_matches(self, prefix):
+        # All words starting with the prefix are adjacent in the sorted list
+        matches = set()
+        i = bisect.bisect_left(self._words, prefix)
+        while i < len(self._words) and self._words[i].startswith(prefix):
+            matches |= self._postings[self._words[i]]
+            i += 1
+        return matches
+
+    def search(self, keyword):
+        with self._lock:
+            words = tokenize(keyword)
+            if not words:
+                keys = set(self.articles)
+            else:
+                # Intersect starting with the rarest word
+                matches = sorted((self._prefix_matches(word) for word in set(words)), key=len)
+                keys = matches[0].intersection(*matches[1:])
+            # Keep the order of the articles on the page
+            return [self.articles[key] for key in sorted(keys, key=self._positions.get)]
+
+
+class HeadlineCache(object):
+    """Keeps scraped articles in memory and refreshes them in the background
+
+    Readers always get the articles already in memory, even once they are
+    older than ttl (stale-while-revalidate), so a request never waits on
+    the upstream site. The first call to get() starts a thread that fetches
+    the articles every ttl seconds; a stale read also triggers a refresh.
+    """
+
+    def __init__(self, fetch, ttl=300):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.articles = []
+        self.fetched_at = None
+        self.index = HeadlineIndex()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._scheduler = None
+        self._stopped = threading.Event()
+
+    def is_stale(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl
+
+    def get(self):
+        self.start()
+        if self.is_stale():
+            self.refresh_in_background()
+        return self.articles
+
+    def search(self, keyword):
+        self.get()
+        return self.index.search(keyword)
+
+    def refresh(self):
+        # Fetch and swap in a new article list, keep the old one on errors.
+        # Another refresh may only start once the index is updated, so two
+        # refreshes never update it at the same time.
+        try:
+            articles = self.fetch()
+            self.index.update(articles)
+            self.articles = articles
+            self.fetched_at = time.monotonic()
+            return True
+        except Exception:
+            logger.exception("Refreshing headlines failed")
+            return False
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def start(self):
+        # Threads do not survive fork, so every worker process starts its own
+        if self._scheduler is None or not self._scheduler.is_alive():
+            with self._lock:
+                if self._scheduler is None or not self._scheduler.is_alive():
+                    self._stopped.clear()
+                    self._scheduler = threading.Thread(target=self._run, daemon=True)
+                    self._scheduler.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.ttl):
+            with self._lock:
+                if self._refreshing:
+                    continue
+                self._refreshing = True
+            self.refresh()
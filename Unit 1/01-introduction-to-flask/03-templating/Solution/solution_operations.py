@@ -0,0 +1,30 @@
+# Calculator operations by name, shared by /math and /math/batch
+import operator
+from fractions import Fraction
+
+# Operations for every mode, each takes two integers
+# Python integers never overflow, so only division differs between modes:
+# 'float' divides with /, 'exact' keeps arbitrary precision as a fraction
+OPERATIONS = {
+    'float': {
+        'add': operator.add,
+        'subtract': operator.sub,
+        'multiply': operator.mul,
+        'divide': operator.truediv,
+    },
+}
+OPERATIONS['exact'] = dict(OPERATIONS['float'], divide=Fraction)
+
+
+def register(name, function, exact_function=None):
+    # Add an operation, e.g. register('power', operator.pow)
+    OPERATIONS['float'][name] = function
+    OPERATIONS['exact'][name] = exact_function or function
+
+
+def calculate(name, n1, n2, mode='float'):
+    # Raises KeyError for operations that are not registered
+    try:
+        return OPERATIONS[mode][name](n1, n2)
+    except ZeroDivisionError:
+        return "Division by zero"
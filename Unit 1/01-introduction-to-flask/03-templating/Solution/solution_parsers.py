@@ -0,0 +1,74 @@
+# Parsers extracting news articles from the raw bytes of a Google News page
+# Every parser returns a list of {'title': ..., 'href': ...} dictionaries
+from io import BytesIO
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+
+def parse_bs4(content):
+    soup = BeautifulSoup(content, "html.parser")
+    return [{
+        'title': title.text,
+        'href': title.parent['href']
+    } for title in soup.select(".titletext")]
+
+
+def parse_lxml(content):
+    # Single streaming pass; elements are dropped once they have been seen,
+    # so memory stays flat however long the page is
+    articles = []
+    open_titles = 0
+    events = etree.iterparse(BytesIO(content), events=('start', 'end'), html=True)
+    for event, element in events:
+        is_title = 'titletext' in element.get('class', '').split()
+        if event == 'start':
+            open_titles += is_title
+            continue
+        if is_title:
+            open_titles -= 1
+            articles.append({
+                'title': ''.join(element.itertext()),
+                'href': element.getparent().get('href')
+            })
+        # Keep the children of a title until its text has been read
+        if not open_titles:
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return articles
+
+
+def parse_selectolax(content):
+    tree = HTMLParser(content)
+    return [{
+        'title': title.text(),
+        'href': title.parent.attributes.get('href')
+    } for title in tree.css(".titletext")]
+
+
+PARSERS = {
+    'html.parser': parse_bs4,
+    'lxml': parse_lxml if etree else None,
+    'selectolax': parse_selectolax if HTMLParser else None,
+}
+
+
+def get_parser(name=None):
+    # Without a name use the fastest installed parser
+    if name is None:
+        for name in ('selectolax', 'lxml', 'html.parser'):
+            if PARSERS[name]:
+                return PARSERS[name]
+    if not PARSERS.get(name):
+        raise ValueError(f"HTML parser {name!r} is not installed")
+    return PARSERS[name]
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Seconds a source may take when it sets no 'timeout' of its own
+DEFAULT_TIMEOUT = 10
+
+
+class CircuitBreaker(object):
+    """Stops calling a source after max_failures failures in a row
+
+    Once open, the source is skipped for reset_timeout seconds, then a
+    single trial request decides whether it closes again.
+    """
+
+    def __init__(self, max_failures=3, reset_timeout=60):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Half-open: let one request through, a failure reopens at once
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+def merge_articles(article_lists):
+    # Keep the first article for every link and for every title
+    seen = set()
+    merged = []
+    for articles in article_lists:
+        for article in articles:
+            keys = (article['href'], article['title'].strip().lower())
+            if keys[0] in seen or keys[1] in seen:
+                continue
+            seen.update(keys)
+            merged.append(article)
+    return merged
+
+
+class HeadlineAggregator(object):
+    """Fetches several news sources concurrently and merges their articles
+
+    Sources are dictionaries with a 'url' and an optional 'timeout' in
+    seconds. All requests share one pooled async client running on a
+    private event loop thread, so callers can stay synchronous, and keeps
+    connections alive between refreshes. Requests are conditional on the
+    ETag / Last-Modified of the previous response; a 304 Not Modified
+    reuses the articles already parsed. A source that fails, times out or
+    has an open circuit breaker contributes the articles of its last
+    successful fetch instead.
+
+    stats holds the outcome of the latest fetch of every source: status
+    and bytes downloaded of the last response, seconds taken and the error
+    of the fetch, None when it succeeded.
+    """
+
+    def __init__(self, parse, max_connections=20, max_failures=3, reset_timeout=60):
+        self.parse = parse
+        self.max_connections = max_connections
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.stats = {}
+        self._last_articles = {}
+        self._validators = {}
+        self._loop = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # The loop thread is started lazily, so every forked worker has its own
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+            limits = httpx.Limits(max_connections=self.max_connections)
+            self._client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+            self._loop = loop
+
+    def fetch(self, sources):
+        self._start()
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(sources), self._loop)
+        return future.result()
+
+    def close(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._client = None
+
+    async def _fetch_all(self, sources):
+        start = time.monotonic()
+        article_lists = await asyncio.gather(
+            *(self._fetch_source(source) for source in sources))
+        logger.info("Fetched %d news sources in %.3f s, %d bytes downloaded",
+                    len(sources), time.monotonic() - start,
+                    sum(self.stats.get(source['url'], {}).get('bytes', 0) for source in sources))
+        return merge_articles(article_lists)
+
+    async def _fetch_source(self, source):
+        url = source['url']
+        breaker = self.breakers.setdefault(
+            url, CircuitBreaker(self.max_failures, self.reset_timeout))
+        if not breaker.allow():
+            return self._last_articles.get(url, [])
+        start = time.monotonic()
+        # httpx applies its timeout to every connect and read, wait_for to
+        # the whole request
+        timeout = source.get('timeout', DEFAULT_TIMEOUT)
+        try:
+            response = await asyncio.wait_for(
+                self._client.get(url, headers=self._validators.get(url, {}), timeout=timeout),
+                timeout)
+            self.stats[url] = {
+                'status': response.status_code,
+                'bytes': response.num_bytes_downloaded,
+                'seconds': time.monotonic() - start,
+                'error': None,
+            }
+            if response.status_code == 304 and url in self._last_articles:
+                breaker.record_success()
+                return self._last_articles[url]
+            response.raise_for_status()
+            # Parse in a thread so other sources keep downloading meanwhile
+            articles = await asyncio.get_running_loop().run_in_executor(
+                None, self.parse, response.content)
+        except Exception as error:
+            logger.warning("Fetching headlines from %s failed: %r", url, error)
+            # Keep the status and bytes of the last response next to the error
+            self.stats[url] = dict(self.stats.get(url, {'status': None, 'bytes': 0}),
+                                   seconds=time.monotonic() - start, error=repr(error))
+            breaker.record_failure()
+            return self._last_articles.get(url, [])
+        breaker.record_success()
+        self._last_articles[url] = articles
+        self._validators[url] = validators(response)
+        return articles
+
+
+def validators(response):
+    # Headers making the next request for the page conditional
+    headers = {}
+    if 'ETag' in response.headers:
+        headers['If-None-Match'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
@@ -1,6 +1,74 @@
-from solution import app
+from solution import app, headlines, parse_articles
+from solution_headlines import HeadlineIndex
+from solution_parsers import PARSERS
+from solution_sources import HeadlineAggregator
+from solution_batch import RECORD
+from solution_operations import register
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import operator
+import os
+import threading
+import time
 import unittest
 
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'solution_fixtures', 'google_news.html')
+
+
+class NewsHandler(BaseHTTPRequestHandler):
+    """Local stand-in for Google News serving a saved page"""
+
+    # Keep connections open between requests like a real server
+    protocol_version = 'HTTP/1.1'
+    etag = '"google-news-1"'
+    hits = []
+    clients = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        self.clients.append(self.client_address)
+        if self.path == '/slow':
+            time.sleep(2)
+        if self.path == '/error':
+            self.send_error(500)
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        with open(FIXTURE, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def news_url(path):
+    return 'http://127.0.0.1:%d%s' % (server.server_port, path)
+
+
+def setUpModule():
+    global server
+    server = ThreadingHTTPServer(('127.0.0.1', 0), NewsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.config['NEWS_SOURCES'] = [{'url': news_url('/'), 'timeout': 5}]
+    headlines.refresh()
+
+
+def tearDownModule():
+    headlines.stop()
+    server.shutdown()
+    server.server_close()
+
+
 class TestTemplateRoutes(unittest.TestCase):
 
     def test_welcome(self):
@@ -45,6 +113,71 @@ class TestTemplateRoutes(unittest.TestCase):
         self.assertIn(b'1', response.data)
         self.assertEqual(response.status_code, 200)
 
+    def test_math_batch(self):
+        tester = app.test_client(self)
+        response = tester.post('/math/batch', json={
+            'num1': [10, 10, 10, 20, 1, 2 ** 62, 2 ** 70],
+            'num2': [20, 20, 120, 0, 3, 4, 1],
+            'calculation': ['add', 'subtract', 'multiply', 'divide', 'divide', 'multiply', 'add'],
+        })
+        self.assertEqual(response.status_code, 200)
+        # Results match /math, without overflowing 64 bit integers
+        self.assertEqual(response.data.decode().splitlines(), [
+            '30', '-10', '1200', 'Division by zero', str(1 / 3), str(2 ** 64), str(2 ** 70 + 1)])
+
+        records = np.zeros(3, dtype=RECORD)
+        records['num1'] = [7, 7, 7]
+        records['num2'] = [2, 0, 2]
+        records['operation'] = [0, 3, 9]
+        response = tester.post('/math/batch', data=records.tobytes(),
+                               content_type='application/octet-stream')
+        self.assertEqual(response.data.decode().splitlines(), [
+            '9', 'Division by zero', 'Error processing request'])
+
+        response = tester.post('/math/batch', json={'num1': [1, 2], 'num2': [1], 'calculation': 'add'})
+        self.assertEqual(response.status_code, 400)
+        # Malformed calculations are refused, not a server error
+        for calculation in [7, {'add': 1}, ['add', 2], [['add'], 'add']]:
+            response = tester.post('/math/batch', json={
+                'num1': [1, 2], 'num2': [1, 2], 'calculation': calculation})
+            self.assertEqual(response.status_code, 400)
+
+        app.config['BATCH_MAX_CALCULATIONS'] = 2
+        try:
+            response = tester.post('/math/batch', json={
+                'num1': [1, 2, 3], 'num2': [1, 2, 3], 'calculation': 'add'})
+            self.assertEqual(response.status_code, 400)
+            response = tester.post('/math/batch', data=records.tobytes(),
+                                   content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 400)
+        finally:
+            app.config['BATCH_MAX_CALCULATIONS'] = 100000
+
+    def test_operation_registry(self):
+        tester = app.test_client(self)
+        response = tester.get('/math?num1=2&num2=10&calculation=power')
+        self.assertEqual(response.data, b'Error processing request')
+
+        register('power', operator.pow)
+        response = tester.get('/math?num1=2&num2=10&calculation=power')
+        self.assertEqual(response.data, b'1024')
+        response = tester.post('/math/batch', json={
+            'num1': [2, 3], 'num2': [10, 2], 'calculation': ['power', 'add']})
+        self.assertEqual(response.data.decode().splitlines(), ['1024', '5'])
+
+        app.config['CALCULATOR_MODE'] = 'exact'
+        try:
+            response = tester.get('/math?num1=1&num2=3&calculation=divide')
+            self.assertEqual(response.data, b'1/3')
+            response = tester.get('/math?num1=1&num2=0&calculation=divide')
+            self.assertEqual(response.data, b'Division by zero')
+            # Batches use the configured mode too
+            response = tester.post('/math/batch', json={
+                'num1': [1, 1, 2], 'num2': [3, 0, 3], 'calculation': ['divide', 'divide', 'add']})
+            self.assertEqual(response.data.decode().splitlines(), ['1/3', 'Division by zero', '5'])
+        finally:
+            app.config['CALCULATOR_MODE'] = 'float'
+
     def test_index(self):
         tester = app.test_client(self)
         response = tester.get('/', content_type='html/text')
@@ -60,5 +193,107 @@ class TestTemplateRoutes(unittest.TestCase):
         self.assertGreater(li_count, 0)
         self.assertLessEqual(li_count, keyword_count)
 
+    def test_results_do_not_wait_on_upstream(self):
+        tester = app.test_client(self)
+        sources = app.config['NEWS_SOURCES']
+        app.config['NEWS_SOURCES'] = [{'url': news_url('/slow'), 'timeout': 5}]
+        # Make the cached headlines stale so the request triggers a refresh
+        headlines.fetched_at = None
+        try:
+            start = time.monotonic()
+            response = tester.get('/results', query_string={'keyword': 'the'})
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertGreater(response.data.count(b'<li'), 0)
+        finally:
+            app.config['NEWS_SOURCES'] = sources
+            # Let the background refresh finish before the server stops
+            while headlines._refreshing:
+                time.sleep(0.05)
+
+    def test_headline_index(self):
+        index = HeadlineIndex()
+        articles = [
+            {'title': 'Weather is nice in Rome', 'href': '/1'},
+            {'title': 'Rome wins the final', 'href': '/2'},
+            {'title': 'Romania votes', 'href': '/3'},
+        ]
+        index.update(articles)
+        self.assertEqual(index.search('rom'), articles)
+        self.assertEqual(index.search('ROME fin'), [articles[1]])
+        self.assertEqual(index.search('rome weather'), [articles[0]])
+        self.assertEqual(index.search('paris'), [])
+        self.assertEqual(index.search(''), articles)
+        # Only the changed articles are indexed again
+        index.update(articles[1:] + [{'title': 'Paris votes', 'href': '/4'}])
+        self.assertEqual(index.search('weather'), [])
+        self.assertEqual([a['href'] for a in index.search('votes')], ['/3', '/4'])
+
+    def test_parsers_agree(self):
+        with open(FIXTURE, 'rb') as f:
+            content = f.read()
+        expected = PARSERS['html.parser'](content)
+        self.assertEqual(len(expected), 84)
+        self.assertEqual(expected[0], {
+            'title': 'Local farmers celebrate an unusual heat wave',
+            'href': 'https://news.example.com/articles/1'})
+        for name, parse in PARSERS.items():
+            if parse:
+                self.assertEqual(parse(content), expected, name)
+
+    def test_aggregator_skips_slow_and_failing_sources(self):
+        aggregator = HeadlineAggregator(parse_articles, max_failures=2)
+        sources = [
+            {'url': news_url('/'), 'timeout': 5},
+            {'url': news_url('/?copy'), 'timeout': 5},
+            {'url': news_url('/slow'), 'timeout': 0.5},
+            {'url': news_url('/error'), 'timeout': 5},
+        ]
+        try:
+            start = time.monotonic()
+            articles = aggregator.fetch(sources)
+            self.assertLess(time.monotonic() - start, 1.5)
+            # Both copies of the page are merged, repeated titles are dropped
+            titles = [article['title'] for article in articles]
+            self.assertEqual(len(titles), len(set(titles)))
+            self.assertEqual(len(articles), 83)
+            self.assertIsNone(aggregator.stats[news_url('/')]['error'])
+            self.assertIn('Timeout', aggregator.stats[news_url('/slow')]['error'])
+            # The status of a failed response is kept with its error
+            self.assertEqual(aggregator.stats[news_url('/error')]['status'], 500)
+            self.assertIn('500', aggregator.stats[news_url('/error')]['error'])
+            aggregator.fetch(sources)
+            self.assertTrue(aggregator.breakers[news_url('/error')].is_open)
+            # The open circuit keeps the failing source from being called
+            NewsHandler.hits.clear()
+            aggregator.fetch(sources[:1] + sources[3:])
+            self.assertEqual(NewsHandler.hits, ['/'])
+        finally:
+            aggregator.close()
+
+    def test_aggregator_fetches_conditionally(self):
+        parsed = []
+
+        def parse(content):
+            parsed.append(content)
+            return parse_articles(content)
+
+        aggregator = HeadlineAggregator(parse)
+        url = news_url('/?conditional')
+        try:
+            NewsHandler.clients.clear()
+            articles = aggregator.fetch([{'url': url}])
+            self.assertEqual(aggregator.stats[url]['status'], 200)
+            self.assertGreater(aggregator.stats[url]['bytes'], 50000)
+            # The page has not changed, so it is neither sent nor parsed again
+            self.assertEqual(aggregator.fetch([{'url': url}]), articles)
+            self.assertEqual(aggregator.stats[url]['status'], 304)
+            self.assertEqual(aggregator.stats[url]['bytes'], 0)
+            self.assertEqual(len(parsed), 1)
+            # Both requests went over the same kept-alive connection
+            self.assertEqual(len(set(NewsHandler.clients)), 1)
+        finally:
+            aggregator.close()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -36,7 +36,12 @@ EmployeeDepartment = db.Table('employee_departments',
                                         db.ForeignKey('employees.id', ondelete="cascade")),
                               db.Column('department_id',
                                         db.Integer,
-                                        db.ForeignKey('departments.id', ondelete="cascade")))
+                                        db.ForeignKey('departments.id', ondelete="cascade"),
+                                        index=True),
+                              # Link a department to an employee once, the index
+                              # also serves lookups by employee_id
+                              db.Index('ix_employee_departments_employee_id_department_id',
+                                       'employee_id', 'department_id', unique=True))
 
 
 class Employee(db.Model):
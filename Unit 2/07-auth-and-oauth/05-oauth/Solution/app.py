@@ -1,4 +1,6 @@
-from project import app
+from project import create_app
+
+app = create_app()
 
 # Allows app to be run with python3 file_name.py
 if __name__ == '__main__':
@@ -0,0 +1,308 @@
+# Benchmarks for the OAuth solution: python3 bench.py
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from sqlalchemy.orm import selectinload
+
+from project import create_app, db
+from project.api.serializers import dumps
+from project.api.views import message_schema
+from project.compression import CompressionMiddleware
+from project.export import export_messages
+from project.importer import import_messages
+from project.tokens import decode
+from project.ratelimit import MemoryStore, SharedCounters, TokenBuckets
+from project.search import search_messages
+from project.tagquery import TagIndex, parse, query_ids
+from project.messages.models import MessageTags
+from project.users.models import User
+from project.messages.models import Message
+from project.tags.models import Tag
+
+
+def seeded_app(users=20, messages=2000):
+    # A throwaway SQLite database with enough rows for long list pages
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'TWITTER_OAUTH': False,
+        'COMPRESS_RESPONSES': False,
+    })
+    with app.app_context():
+        db.create_all()
+        tags = [Tag("Tag %d" % i) for i in range(20)]
+        db.session.add_all([User("First %d" % i, "Last %d" % i, "user%d" % i, "secret")
+                            for i in range(users)])
+        for i in range(messages):
+            message = Message("Message number %d from the benchmark" % i, i % users + 1)
+            message.tags.extend(tags[i % 20:i % 20 + 3])
+            db.session.add(message)
+        db.session.commit()
+    return app
+
+
+def bench_boot(runs=7):
+    # Wall time of a fresh interpreter loading the app as a gunicorn worker
+    # does (gunicorn.conf.py: wsgi_app = "app:app"), and the package alone
+    for code in ["from app import app", "import project"]:
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True)
+            times.append(time.perf_counter() - start)
+        print("%-22s median %4.0f ms of %d runs" % (code, statistics.median(times) * 1000, runs))
+
+
+def bench_compression(runs=20):
+    app = seeded_app()
+    page = app.test_client().get('/messages').data
+
+    def page_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
+        return [page]
+
+    print("/messages page of %d bytes, mean of %d runs:" % (len(page), runs))
+    settings = [('gzip', 'level', level) for level in (1, 6, 9)]
+    settings += [('br', 'brotli_quality', quality) for quality in (1, 4, 11)]
+    for encoding, option, value in settings:
+        middleware = CompressionMiddleware(page_app, **{option: value})
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': encoding}
+
+        def compress():
+            return b''.join(middleware(environ, lambda *args: None))
+
+        seconds = timeit.timeit(compress, number=runs) / runs
+        size = len(compress())
+        print("  %-4s %-14s %2d  %7d bytes (%4.1f%%)  %6.2f ms"
+              % (encoding, option, value, size, 100 * size / len(page), seconds * 1000))
+
+
+def naive_message(message):
+    # Building every dictionary by hand, as views usually do
+    return {
+        'id': message.id,
+        'content': message.content,
+        'user_id': message.user_id,
+        'version': message.version,
+        'tags': [{'id': tag.id, 'name': tag.name, 'version': tag.version} for tag in message.tags],
+    }
+
+
+def bench_serialization(runs=20):
+    app = seeded_app()
+    with app.app_context():
+        messages = Message.query.options(selectinload(Message.tags)).all()
+        serialize = message_schema.serializer()
+        selected = message_schema.serializer(message_schema.select('id,content'))
+
+        def naive():
+            return json.dumps([naive_message(message) for message in messages]).encode()
+
+        def compiled():
+            return dumps([serialize(message) for message in messages])
+
+        def compiled_selected():
+            return dumps([selected(message) for message in messages])
+
+        print("serializing %d messages with 3 tags each, mean of %d runs:" % (len(messages), runs))
+        for name, fn in [('naive dicts + json', naive), ('compiled + fast encoder', compiled),
+                         ('?fields=id,content', compiled_selected)]:
+            seconds = timeit.timeit(fn, number=runs) / runs
+            print("  %-24s %7.2f ms  %7d bytes" % (name, seconds * 1000, len(fn())))
+
+
+def bench_export(messages=20000):
+    app = seeded_app(messages=messages)
+    with app.app_context():
+        for batch_size in (100, 1000):
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in export_messages(batch_size=batch_size))
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("exported %d messages (%d bytes) in batches of %d: %.2f s, %.0f messages/s, peak %.1f MB"
+                  % (messages, size, batch_size, seconds, messages / seconds, peak / 2 ** 20))
+
+
+def bench_import(messages=20000):
+    lines = [json.dumps({'user': 'user%d' % (i % 20), 'content': "Imported message %d" % i,
+                         'tags': ["Tag %d" % (i % 50), "Tag %d" % (i % 7)]})
+             for i in range(messages)]
+    app = seeded_app(messages=0)
+    with app.app_context():
+        # One ORM object and commit per message, as the HTML forms do
+        tags = {}
+        start = time.perf_counter()
+        for line in lines[:1000]:
+            record = json.loads(line)
+            message = Message(record['content'], User.query.filter_by(username=record['user']).first().id)
+            for name in dict.fromkeys(record['tags']):
+                if name not in tags:
+                    tags[name] = Tag(name)
+                message.tags.append(tags[name])
+            db.session.add(message)
+            db.session.commit()
+        seconds = time.perf_counter() - start
+        print("ORM, commit per message: %.0f messages/s" % (1000 / seconds))
+    for batch_size in (1000, 5000):
+        app = seeded_app(messages=0)
+        with app.app_context():
+            report = import_messages(lines, batch_size)
+            print("bulk import of %d messages in batches of %d: %.2f s, %d messages/s"
+                  % (report.imported, batch_size, report.seconds,
+                     report.as_dict()['messages_per_second']))
+
+
+def bench_batch(operations=1000):
+    # The same 1k creates, updates and deletes as form requests and as one batch
+    third = operations // 3
+    for name in ('one request per operation', 'one batch request'):
+        app = seeded_app(users=1, messages=0)
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = app.test_client()
+        client.post('/users/login', data={'username': 'user0', 'password': 'secret'})
+        with app.app_context():
+            db.session.add_all([Message("Existing %d" % i, 1) for i in range(2 * third)])
+            db.session.commit()
+        start = time.perf_counter()
+        if name == 'one request per operation':
+            for i in range(operations - 2 * third):
+                client.post('/users/1/messages/', data={'content': "New %d" % i})
+            for id in range(1, third + 1):
+                client.post('/users/1/messages/%d?_method=PATCH' % id, data={'content': "Changed"})
+            for id in range(third + 1, 2 * third + 1):
+                client.post('/users/1/messages/%d?_method=DELETE' % id)
+        else:
+            batch = [{'op': 'create', 'content': "New %d" % i} for i in range(operations - 2 * third)]
+            batch += [{'op': 'update', 'id': id, 'content': "Changed"} for id in range(1, third + 1)]
+            batch += [{'op': 'delete', 'id': id} for id in range(third + 1, 2 * third + 1)]
+            assert client.post('/api/v1/users/1/messages/batch', json=batch).status_code == 200
+        seconds = time.perf_counter() - start
+        print("%d operations, %-26s %8.1f ms" % (operations, name, seconds * 1000))
+
+
+def bench_tokens(runs=10000):
+    app = seeded_app(users=1, messages=0)
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    tokens = client.post('/api/v1/tokens', data=json.dumps(
+        {'username': 'user0', 'password': 'secret'})).get_json()
+    key = app.config['SECRET_KEY']
+    seconds = timeit.timeit(lambda: decode(tokens['access_token'], key, 'access'), number=runs) / runs
+    print("verifying an access token: %.1f us" % (seconds * 1e6))
+
+    # GET /api/v1/me with the token, and with a Flask-Login session cookie
+    bearer = {'Authorization': 'Bearer ' + tokens['access_token']}
+    client.post('/users/login', data={'username': 'user0', 'password': 'secret'})
+    for name, headers in [('access token', bearer), ('session cookie', {})]:
+        assert client.get('/api/v1/me', headers=headers).status_code == 200
+        seconds = timeit.timeit(lambda: client.get('/api/v1/me', headers=headers), number=runs // 10)
+        print("GET /api/v1/me with %-14s %6.0f us" % (name, seconds / (runs // 10) * 1e6))
+
+
+def bench_ratelimit(runs=100000, logins=50):
+    for name, backend in [('token buckets', TokenBuckets()),
+                          ('shared counters (memory store)', SharedCounters(MemoryStore()))]:
+        seconds = timeit.timeit(lambda: backend.hit('client', 10, 60), number=runs) / runs
+        print("checking a limit with %-31s %5.2f us" % (name, seconds * 1e6))
+
+    # One client sending wrong passwords as fast as it can
+    app = seeded_app(users=1, messages=0)
+    app.config['WTF_CSRF_ENABLED'] = False
+    for enabled in (False, True):
+        app.config['RATELIMIT_ENABLED'] = enabled
+        client = app.test_client()
+        start = time.perf_counter()
+        for i in range(logins):
+            client.post('/users/login', data={'username': 'user0', 'password': 'wrong'})
+        seconds = time.perf_counter() - start
+        print("%d failed logins, rate limit %-3s  %6.0f ms"
+              % (logins, 'on' if enabled else 'off', seconds * 1000))
+
+
+def bench_search(messages=1000000, runs=20):
+    # Words of a Zipf-like vocabulary, so some are in most messages and some in few
+    rng = random.Random(0)
+    words = ["word%d" % i for i in range(5000)]
+    weights = [1 / (i + 1) for i in range(len(words))]
+    app = seeded_app(users=1, messages=0)
+    with app.app_context():
+        start = time.perf_counter()
+        for offset in range(0, messages, 50000):
+            db.session.execute(Message.__table__.insert(), [
+                {'content': ' '.join(rng.choices(words, weights, k=8)), 'user_id': 1, 'version': 1}
+                for i in range(offset, min(messages, offset + 50000))])
+            db.session.commit()
+        print("indexed %d messages in %.0f s" % (messages, time.perf_counter() - start))
+        client = app.test_client()
+        for query, page in [('word4000', 1), ('word50', 1), ('word50', 50), ('word0', 1),
+                            ('word0 word1', 1), ('word0 word4000', 1)]:
+            seconds = timeit.timeit(lambda: search_messages(query, page), number=runs) / runs
+            url = '/api/v1/search/messages?q=%s&page=%d' % (query, page)
+            request = timeit.timeit(lambda: client.get(url), number=runs) / runs
+            print("  %-16s page %2d  search %8.2f ms  request %8.2f ms"
+                  % (query, page, seconds * 1000, request * 1000))
+
+
+def bench_tag_query(messages=200000, tags=50, runs=20):
+    # Every message has 3 tags, drawn so the first tags are the most common
+    rng = random.Random(0)
+    weights = [1 / (i + 1) for i in range(tags)]
+    app = seeded_app(users=1, messages=0)
+    with app.app_context():
+        all_tags = Tag.query.order_by(Tag.id).all()
+        all_tags += [Tag("Tag %d" % i) for i in range(len(all_tags), tags)]
+        db.session.add_all(all_tags)
+        db.session.commit()
+        tag_ids = [tag.id for tag in all_tags]
+        for offset in range(0, messages, 50000):
+            ids = range(offset + 1, min(messages, offset + 50000) + 1)
+            db.session.execute(Message.__table__.insert(), [
+                {'id': id, 'content': "Message %d" % id, 'user_id': 1, 'version': 1} for id in ids])
+            db.session.execute(MessageTags.insert(), [
+                {'message_id': id, 'tag_id': tag_id} for id in ids
+                for tag_id in set(rng.choices(tag_ids, weights, k=3))])
+            db.session.commit()
+        index = TagIndex()
+
+        def naive(tree):
+            # Loading the messages of every tag through the backref
+            include = [{m.id for m in Tag.query.filter_by(name=name).first().messages}
+                       for name in ("Tag 0", "Tag 1")]
+            exclude = {m.id for m in Tag.query.filter_by(name="Tag 2").first().messages}
+            return sorted((include[0] & include[1]) - exclude)
+
+        print("%d messages, 3 of %d tags each, mean of %d runs:" % (messages, tags, runs))
+        for expression in ['"Tag 0" AND "Tag 1" NOT "Tag 2"', '"Tag 10" OR "Tag 40"',
+                           '"Tag 30" AND NOT "Tag 0"']:
+            tree = parse(expression)
+            methods = [('sql', query_ids), ('bitmaps', index.query)]
+            if expression.startswith('"Tag 0" AND'):
+                methods.insert(0, ('backref sets', naive))
+            index.query(tree)
+            for name, fn in methods:
+                seconds = timeit.timeit(lambda: fn(tree), number=runs if name != 'backref sets' else 1)
+                seconds /= runs if name != 'backref sets' else 1
+                print("  %-34s %-12s %9.3f ms" % (expression, name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    bench_boot()
+    bench_compression()
+    bench_serialization()
+    bench_export()
+    bench_import()
+    bench_batch()
+    bench_tokens()
+    bench_ratelimit()
+    bench_search()
+    bench_tag_query()
@@ -0,0 +1,35 @@
+import gc
+import multiprocessing
+
+# Run with: gunicorn -c gunicorn.conf.py
+wsgi_app = "app:app"
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count() * 2 + 1
+
+# Import the app once in the master, workers are forked from it and share
+# the imported modules, mappers and compiled templates copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # Called in the master after the app is loaded, before workers are forked
+    from project import db
+    from project.warmup import warm_app
+
+    app = server.app.wsgi()
+    warm_app(app)
+    # Workers must not inherit connections opened by the master
+    with app.app_context():
+        db.engine.dispose()
+    # Move everything allocated so far out of the garbage collector's reach,
+    # so collections in the workers do not touch (and copy) shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Give each worker its own connection pool
+    from project import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
@@ -1,7 +1,13 @@
-from project import app, db
+from project import create_app, db
+from project.assets import build_assets
+from project.export import checkpoint, export_messages
+from project.importer import import_messages as import_records
+from project.search import create_index
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager
 
+app = create_app()
+
 # Configure Flask Migrate
 migrate = Migrate(app, db)
 
@@ -9,8 +15,49 @@ migrate = Migrate(app, db)
 manager = Manager(app)
 
 # Run Flask Migrate commands: python3 solution_manage.py db [insert command]
+# Bring databases made with db.create_all() up to date with: python3 manage.py db upgrade
 manager.add_command('db', MigrateCommand)
 
+
+# Fingerprint and compress static files: python3 manage.py assets
+# Restart the app afterwards so url_for picks up the new names
+@manager.command
+def assets():
+    manifest = build_assets(app.static_folder)
+    for filename, fingerprinted in sorted(manifest.items()):
+        print(filename, '->', fingerprinted)
+
+# Export messages as newline-delimited JSON: python3 manage.py export messages.ndjson
+# Run it again with the same file to resume an interrupted export
+@manager.option('path', help='File the messages are appended to')
+def export(path):
+    after = checkpoint(path)
+    with open(path, 'ab') as f:
+        for chunk in export_messages(after, app.config['EXPORT_BATCH_SIZE']):
+            f.write(chunk)
+
+
+# Import messages from newline-delimited JSON: python3 manage.py import_messages messages.ndjson
+# Each line is like {"user": "joe", "content": "Hello", "tags": ["Greeting"]}
+@manager.option('path', help='File to read the messages from')
+def import_messages(path):
+    with open(path, 'rb') as f:
+        report = import_records(f, app.config['IMPORT_BATCH_SIZE'])
+    print("Imported %d messages in %.2f s (%d per second), rejected %d"
+          % (report.imported, report.seconds, report.as_dict()['messages_per_second'],
+             report.rejected_count))
+    for rejected in report.rejected:
+        print("line %(line)d: %(reason)s" % rejected)
+
+
+# Add the full-text search index to a database created without it: python3 manage.py search_index
+# Databases managed with migrations get it from python3 manage.py db upgrade instead
+@manager.command
+def search_index():
+    with db.engine.begin() as connection:
+        create_index(connection)
+
+
 # Do not run if this module is being imported
 if __name__ == '__main__':
     manager.run()
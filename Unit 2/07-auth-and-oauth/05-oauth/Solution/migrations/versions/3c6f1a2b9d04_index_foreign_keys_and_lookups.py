@@ -0,0 +1,56 @@
+"""Index foreign keys and lookup columns, link tags to a message once
+
+Databases of this project were created with db.create_all(), so every
+revision skips what create_all already made. This first one adds the
+indexes; the later ones add the version columns, the search index and
+the table_versions and revoked_tokens tables. Duplicate messages_tags
+rows are removed before the unique index on (message_id, tag_id) is
+created.
+
+Revision ID: 3c6f1a2b9d04
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c6f1a2b9d04'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns, unique)
+INDEXES = [
+    ('ix_messages_user_id', 'messages', ['user_id'], False),
+    ('ix_messages_tags_tag_id', 'messages_tags', ['tag_id'], False),
+    ('ix_messages_tags_message_id_tag_id', 'messages_tags', ['message_id', 'tag_id'], True),
+    ('ix_tags_name', 'tags', ['name'], False),
+    ('ix_flask_dance_oauth_user_id', 'flask_dance_oauth', ['user_id'], False),
+]
+
+
+def existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    return tables, {index['name'] for table in tables for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    tables, indexes = existing_indexes()
+    if 'messages_tags' in tables and 'ix_messages_tags_message_id_tag_id' not in indexes:
+        op.execute("DELETE FROM messages_tags WHERE id NOT IN "
+                   "(SELECT min(id) FROM messages_tags GROUP BY message_id, tag_id)")
+    for name, table, columns, unique in INDEXES:
+        # The OAuth table only exists when Twitter login is enabled
+        if table in tables and name not in indexes:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    tables, indexes = existing_indexes()
+    for name, table, columns, unique in reversed(INDEXES):
+        if name in indexes:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,70 @@
+"""Add full-text search of messages
+
+PostgreSQL gets a generated search_vector column with a GIN index, SQLite
+an FTS5 table kept in step by triggers and filled from the existing
+messages. The statements are those of project/search.py, which runs them
+for databases made with create_all. Skipped when they already exist.
+
+Revision ID: 5b9e0c4d7a12
+Revises: 8e41d7c2a5f3
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e0c4d7a12'
+down_revision = '8e41d7c2a5f3'
+branch_labels = None
+depends_on = None
+
+POSTGRESQL = [
+    "ALTER TABLE messages ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    "(to_tsvector('english', coalesce(content, ''))) STORED",
+    "CREATE INDEX ix_messages_search_vector ON messages USING GIN (search_vector)",
+]
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+]
+
+
+def exists(dialect):
+    inspector = sa.inspect(op.get_bind())
+    if dialect == 'postgresql':
+        return 'search_vector' in {column['name'] for column in inspector.get_columns('messages')}
+    return 'messages_fts' in inspector.get_table_names()
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite') or exists(dialect):
+        return
+    for statement in POSTGRESQL if dialect == 'postgresql' else SQLITE:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite') or not exists(dialect):
+        return
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_messages_search_vector")
+        op.execute("ALTER TABLE messages DROP COLUMN search_vector")
+    else:
+        for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+            op.execute("DROP TRIGGER %s" % trigger)
+        op.execute("DROP TABLE messages_fts")
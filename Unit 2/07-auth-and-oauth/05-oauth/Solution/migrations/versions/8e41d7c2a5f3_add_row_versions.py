@@ -0,0 +1,39 @@
+"""Add version columns to messages and tags
+
+Cached tag lists are keyed on these versions. Existing rows start at
+version 1, the model default. Columns create_all already made are skipped.
+
+Revision ID: 8e41d7c2a5f3
+Revises: 3c6f1a2b9d04
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41d7c2a5f3'
+down_revision = '3c6f1a2b9d04'
+branch_labels = None
+depends_on = None
+
+TABLES = ['messages', 'tags']
+
+
+def existing_columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    for table in TABLES:
+        if 'version' not in existing_columns(table):
+            op.add_column(table, sa.Column('version', sa.Integer(), nullable=False,
+                                           server_default='1'))
+
+
+def downgrade():
+    for table in TABLES:
+        if 'version' in existing_columns(table):
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.drop_column('version')
@@ -0,0 +1,48 @@
+"""Add table_versions and revoked_tokens
+
+table_versions holds the version of every table, which ETags and cached
+fragments are keyed on. revoked_tokens lists the API refresh tokens
+logged out before they expire. Tables create_all already made are skipped.
+
+Revision ID: d27a6e1f8b35
+Revises: 5b9e0c4d7a12
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27a6e1f8b35'
+down_revision = '5b9e0c4d7a12'
+branch_labels = None
+depends_on = None
+
+
+def existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    tables = existing_tables()
+    if 'table_versions' not in tables:
+        op.create_table(
+            'table_versions',
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('name'))
+    if 'revoked_tokens' not in tables:
+        op.create_table(
+            'revoked_tokens',
+            sa.Column('jti', sa.String(length=32), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('jti'))
+
+
+def downgrade():
+    tables = existing_tables()
+    for table in ('revoked_tokens', 'table_versions'):
+        if table in tables:
+            op.drop_table(table)
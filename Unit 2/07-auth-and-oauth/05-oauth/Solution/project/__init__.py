@@ -1,75 +1,171 @@
+import os
+
 # Flask and extensions
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect
 from flask_modus import Modus
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-from flask_dance.contrib.twitter import make_twitter_blueprint, twitter
-from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Create instance of Flask class
-app = Flask(__name__)
+from project.templating import init_template_cache, init_fragment_cache, warm_templates
+from project.assets import init_assets
+from project.compression import init_compression
+from project.ratelimit import RateLimiter
 
-# Configure Flask Modus
-modus = Modus(app)
+# Create extensions without an app, create_app binds them with init_app
+modus = Modus()
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = "users.login"
+limiter = RateLimiter()
 
-# Configure SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres://localhost/users-oauth'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
 
-# Configure bcrypt
-bcrypt = Bcrypt(app)
+def create_app(config=None):
+    # Create instance of Flask class
+    app = Flask(__name__)
 
-# Configure Flask Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "users.login"
+    # Configure SQLAlchemy
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres://localhost/users-oauth'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Configure Flask Dance
-twitter_blueprint = make_twitter_blueprint(
-    api_key="WccILPLiPOw14vVm0QNUwEMtK",
-    api_secret="XI296LpbPst9iRU7dgKFyiPLMZg25PBSpPJDywTSxqebX3BZI8",
-)
+    # Set secret key
+    # For production set secret key in env variable: os.environ.get('SECRET_KEY')
+    app.config['SECRET_KEY'] = "this_is_an_insecure_development_key"
 
-# Configure Flask Migrate
-migrate = Migrate(app, db)
+    # Configure Flask Dance, which is only imported if Twitter login is enabled
+    app.config['TWITTER_OAUTH'] = True
+    app.config['TWITTER_API_KEY'] = "WccILPLiPOw14vVm0QNUwEMtK"
+    app.config['TWITTER_API_SECRET'] = "XI296LpbPst9iRU7dgKFyiPLMZg25PBSpPJDywTSxqebX3BZI8"
 
-# Set secret key
-# For production set secret key in env variable: os.environ.get('SECRET_KEY')
-app.config['SECRET_KEY'] = "this_is_an_insecure_development_key"
+    # Configure Jinja bytecode cache and optional template warm-up
+    # Set TEMPLATE_WARMUP=1 to compile all templates before serving requests
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR')
+    app.config['TEMPLATE_WARMUP'] = os.environ.get('TEMPLATE_WARMUP') == '1'
 
-# Import blueprints here to avoid circular imports
-from project.users.views import users_blueprint
-from project.messages.views import messages_blueprint
-from project.tags.views import tags_blueprint
+    # Bound the rendered fragments kept by {% cache %} to about 1 MB of text
+    app.config['FRAGMENT_CACHE_MAX_SIZE'] = 2 ** 20
 
-# Register blueprints
-app.register_blueprint(users_blueprint, url_prefix='/users')
-app.register_blueprint(
-    messages_blueprint, url_prefix='/users/<int:user_id>/messages')
-app.register_blueprint(tags_blueprint, url_prefix='/tags')
-# Register Flask Dance Twitter blueprint
-app.register_blueprint(twitter_blueprint, url_prefix="/login")
+    # Serve fingerprinted static files built with: python3 manage.py assets
+    # Set USE_X_SENDFILE or an nginx internal location such as '/protected/'
+    # to let the web server in front send the files
+    app.config['USE_X_SENDFILE'] = False
+    app.config['ASSETS_ACCEL_REDIRECT'] = None
+    # Serve static files from another folder, e.g. a separate build
+    app.config['STATIC_FOLDER'] = None
 
-# Finalize Flask Login setup
+    # Identifies the deployed code in ETags, so pages cached by browsers are
+    # revalidated after a deploy even when no table changed
+    app.config['APP_VERSION'] = os.environ.get('APP_VERSION', '')
+
+    # Compress responses of at least 500 bytes for clients accepting it
+    # Brotli quality 4 and gzip level 6 trade little size for much less CPU
+    app.config['COMPRESS_RESPONSES'] = True
+    app.config['COMPRESS_MIN_SIZE'] = 500
+    app.config['COMPRESS_LEVEL'] = 6
+    app.config['COMPRESS_BROTLI_QUALITY'] = 4
+
+    # Lifetimes in seconds of API access tokens and refresh tokens, see project/tokens.py
+    app.config['JWT_ACCESS_TTL'] = 15 * 60
+    app.config['JWT_REFRESH_TTL'] = 30 * 24 * 60 * 60
+
+    # Requests per client to routes that hash passwords or write, by endpoint
+    # or blueprint. Set RATELIMIT_STORE to a redis.Redis client to share the
+    # counters between processes and servers, else each process counts alone.
+    app.config['RATELIMIT_ENABLED'] = True
+    app.config['RATELIMIT_METHODS'] = {'POST', 'PATCH', 'DELETE'}
+    app.config['RATELIMITS'] = {
+        'users.login': '10/minute',
+        'users.signup': '5/minute',
+        'api.tokens': '10/minute',
+        'messages.messages': '30/minute',
+        'api': '60/minute',
+    }
+    app.config['RATELIMIT_STORE'] = None
+    # Reverse proxies in front of the app, e.g. 1 behind nginx. The client
+    # address is then read from their X-Forwarded-For header, which clients
+    # could forge if no proxy set it.
+    app.config['PROXY_COUNT'] = 0
+
+    # Results per page of /api/v1/search/messages, and the most ?per_page= allows
+    app.config['SEARCH_PER_PAGE'] = 20
+    app.config['SEARCH_MAX_PER_PAGE'] = 100
+
+    # Message ids per page of /api/v1/tags/query, and the most ?per_page= allows
+    # TAG_INDEX answers from in-memory bitmaps of recently queried tags
+    # instead of one SQL query per request
+    app.config['TAG_QUERY_PER_PAGE'] = 1000
+    app.config['TAG_QUERY_MAX_PER_PAGE'] = 10000
+    app.config['TAG_INDEX'] = True
+
+    # Rows read from the database cursor, and lines sent, at a time by exports
+    app.config['EXPORT_BATCH_SIZE'] = 1000
+    # Records written per transaction by bulk imports
+    app.config['IMPORT_BATCH_SIZE'] = 5000
+    # Operations accepted by one request to /api/v1/users/<id>/messages/batch
+    app.config['BATCH_MAX_OPERATIONS'] = 1000
+
+    # Override the defaults above, e.g. with testing configuration
+    if config:
+        app.config.update(config)
+    if app.config['STATIC_FOLDER']:
+        app.static_folder = app.config['STATIC_FOLDER']
 
-from project.users.models import User
+    # Configure extensions
+    modus.init_app(app)
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    limiter.init_app(app)
+
+    # Import blueprints here to avoid circular imports
+    from project.users.views import users_blueprint
+    from project.messages.views import messages_blueprint, messages_index
+    from project.tags.views import tags_blueprint
+    from project.api.views import api_blueprint
+
+    # Register blueprints
+    app.register_blueprint(users_blueprint, url_prefix='/users')
+    app.register_blueprint(
+        messages_blueprint, url_prefix='/users/<int:user_id>/messages')
+    app.register_blueprint(tags_blueprint, url_prefix='/tags')
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+    app.add_url_rule('/messages', view_func=messages_index)
+
+    # Register Flask Dance Twitter blueprint
+    if app.config['TWITTER_OAUTH']:
+        from project.oauth import init_oauth
+        init_oauth(app)
+
+    app.add_url_rule('/', view_func=home)
+
+    init_template_cache(app)
+    init_fragment_cache(app)
+    init_assets(app)
+
+    # Let templates key cached fragments on table versions, after the asset
+    # manifest is loaded for the ETag build id
+    from project.versions import init_versions
+    init_versions(app)
+    if app.config['COMPRESS_RESPONSES']:
+        init_compression(app)
+    if app.config['TEMPLATE_WARMUP']:
+        warm_templates(app)
+    if app.config['PROXY_COUNT']:
+        count = app.config['PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=count, x_proto=count)
+
+    return app
+
+
+# Finalize Flask Login setup
 
 @login_manager.user_loader
 def load_user(user_id):
+    from project.users.models import User
     return User.query.get(user_id)
 
-@app.route('/', methods=["GET"])
+
 def home():
     return redirect('users')
-
-"""
-@app.route("/")
-def index():
-    if not twitter.authorized:
-        return redirect(url_for("twitter.login"))
-    resp = twitter.get("account/settings.json")
-    assert resp.ok
-    return "You are @{screen_name} on Twitter".format(screen_name=resp.json()["screen_name"])
-"""
@@ -0,0 +1,82 @@
+import json
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Nested(object):
+    # A relationship serialized with another schema, many for collections
+    def __init__(self, schema, many=False):
+        self.schema = schema
+        self.many = many
+
+
+class Schema(object):
+    """Declares the fields of a model that are serialized to JSON
+
+    Fields map to None for plain attributes, or to Nested for
+    relationships. For every selection of fields a serializer function is
+    generated once, e.g. lambda obj: {'id': obj.id, 'name': obj.name},
+    so serializing an object does not loop over the declared fields.
+    Selections are put in declared order without repeats first, so at
+    most one serializer is kept per subset of the declared fields.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self._serializers = {}
+
+    def select(self, fields=None):
+        # Parses ?fields=id,name, all fields when it is missing
+        if not fields:
+            return tuple(self.fields)
+        names = [name.strip() for name in fields.split(',')]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError("Unknown fields: " + ", ".join(unknown))
+        return self.canonical(names)
+
+    def canonical(self, names):
+        # The declared fields among names, in declared order
+        names = set(names)
+        return tuple(name for name in self.fields if name in names)
+
+    def nested(self, names):
+        return [name for name in names if self.fields[name] is not None]
+
+    def serializer(self, names=None):
+        names = self.canonical(names) if names else tuple(self.fields)
+        serializer = self._serializers.get(names)
+        if serializer is None:
+            serializer = self._serializers[names] = self._compile(names)
+        return serializer
+
+    def _compile(self, names):
+        namespace = {}
+        items = []
+        for i, name in enumerate(names):
+            field = self.fields[name]
+            if field is None:
+                items.append(f"{name!r}: obj.{name}")
+                continue
+            namespace[f"nested{i}"] = field.schema.serializer()
+            if field.many:
+                items.append(f"{name!r}: [nested{i}(o) for o in obj.{name}]")
+            else:
+                items.append(f"{name!r}: nested{i}(obj.{name}) if obj.{name} is not None else None")
+        return eval("lambda obj: {%s}" % ", ".join(items), namespace)
+
+
+def dumps(data):
+    # orjson is several times faster than json when it is installed
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return current_app.response_class(dumps(data), status=status, mimetype='application/json')
@@ -0,0 +1,236 @@
+from flask import Blueprint, Response, current_app, g, request, stream_with_context
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import (BadRequest, Forbidden, HTTPException, Unauthorized,
+                                 UnsupportedMediaType)
+
+from project import limiter
+from project.api.serializers import Nested, Schema, json_response
+from project.batch import BatchError, apply_operations
+from project.export import export_messages
+from project.importer import import_messages
+from project.search import search_messages
+from project.tagquery import parse, query_ids, tag_index
+from project.users.models import User
+from project.messages.models import Message
+from project.tags.models import Tag
+from project.tokens import InvalidToken, api_login_required, issue_tokens, refresh_claims, revoke
+from project.versions import conditional
+
+api_blueprint = Blueprint('api', __name__)
+
+# Fields clients may select with ?fields=. These routes are public, so
+# passwords and usernames, which are the login names, are never exposed
+tag_schema = Schema(id=None, name=None, version=None)
+message_schema = Schema(id=None, content=None, user_id=None, version=None,
+                        tags=Nested(tag_schema, many=True))
+user_schema = Schema(id=None, first_name=None, last_name=None)
+
+
+def selected_fields(schema):
+    try:
+        return schema.select(request.args.get('fields'))
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+
+def serialize_all(model, schema, query=None):
+    names = selected_fields(schema)
+    query = query if query is not None else model.query
+    # Load selected relationships in one query instead of one per object
+    for name in schema.nested(names):
+        query = query.options(selectinload(getattr(model, name)))
+    serialize = schema.serializer(names)
+    return json_response([serialize(obj) for obj in query.order_by(model.id)])
+
+
+def serialize_one(model, schema, id):
+    names = selected_fields(schema)
+    return json_response(schema.serializer(names)(model.query.get_or_404(id)))
+
+
+def json_field(name):
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(name), str):
+        raise BadRequest("Expected a JSON object with %s" % name)
+    return data[name]
+
+
+@api_blueprint.errorhandler(HTTPException)
+def error(error):
+    return json_response({'error': error.description}, error.code)
+
+
+# Tokens: send "Authorization: Bearer <access_token>" with API requests
+
+@api_blueprint.route('/tokens', methods=['POST'])
+def tokens():
+    user = User.authenticate(json_field('username'), json_field('password'))
+    if not user:
+        raise Unauthorized("Invalid Credentials")
+    return json_response(issue_tokens(user))
+
+
+@api_blueprint.route('/tokens/refresh', methods=['POST'])
+def refresh_tokens():
+    # Refresh tokens are used once, a new one is issued with the access token
+    try:
+        claims = refresh_claims(json_field('refresh_token'))
+    except InvalidToken as error:
+        raise Unauthorized(str(error))
+    user = User.query.get(claims['sub'])
+    if user is None:
+        raise Unauthorized("Unknown user")
+    revoke(claims)
+    return json_response(issue_tokens(user))
+
+
+@api_blueprint.route('/tokens/revoke', methods=['POST'])
+def revoke_token():
+    try:
+        claims = refresh_claims(json_field('refresh_token'))
+    except InvalidToken as error:
+        raise Unauthorized(str(error))
+    revoke(claims)
+    return json_response({'revoked': True})
+
+
+@api_blueprint.route('/me')
+@api_login_required
+def me():
+    return json_response(g.api_user._asdict())
+
+
+@api_blueprint.route('/ratelimit')
+@api_login_required
+def ratelimit():
+    # Requests allowed and refused by this process, per limited route
+    return json_response(limiter.stats())
+
+
+@api_blueprint.route('/users')
+@conditional('users')
+def users():
+    return serialize_all(User, user_schema)
+
+
+@api_blueprint.route('/users/<int:id>')
+@conditional('users')
+def user(id):
+    return serialize_one(User, user_schema, id)
+
+
+@api_blueprint.route('/users/<int:id>/messages')
+@conditional('users', 'messages', 'tags')
+def user_messages(id):
+    User.query.get_or_404(id)
+    return serialize_all(Message, message_schema, Message.query.filter_by(user_id=id))
+
+
+@api_blueprint.route('/users/<int:id>/messages/batch', methods=['POST'])
+@api_login_required
+def user_messages_batch(id):
+    # Creates, updates and deletes messages of the current user in one commit
+    if id != g.api_user.id:
+        raise Forbidden("Not Authorized")
+    # Forms cannot send JSON cross-site, only text/plain bodies resembling it
+    if not request.is_json:
+        raise UnsupportedMediaType("Expected application/json")
+    try:
+        results = apply_operations(id, request.get_json(silent=True),
+                                   current_app.config['BATCH_MAX_OPERATIONS'])
+    except BatchError as error:
+        return json_response({'error': str(error), 'results': error.results}, 400)
+    return json_response({'results': results})
+
+
+@api_blueprint.route('/messages')
+@conditional('messages', 'tags')
+def messages():
+    return serialize_all(Message, message_schema)
+
+
+@api_blueprint.route('/messages/<int:id>')
+@conditional('messages', 'tags')
+def message(id):
+    return serialize_one(Message, message_schema, id)
+
+
+@api_blueprint.route('/search/messages')
+@conditional('messages', 'tags')
+def search():
+    # Messages matching every word of ?q=, best match first, ?page= at a time
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', current_app.config['SEARCH_PER_PAGE'], type=int)
+    if page < 1 or not 0 < per_page <= current_app.config['SEARCH_MAX_PER_PAGE']:
+        raise BadRequest("Invalid page or per_page")
+    names = selected_fields(message_schema)
+    ids = search_messages(request.args.get('q', ''), page, per_page)
+    query = Message.query.filter(Message.id.in_(ids[:per_page]))
+    for name in message_schema.nested(names):
+        query = query.options(selectinload(getattr(Message, name)))
+    messages = {message.id: message for message in query}
+    serialize = message_schema.serializer(names)
+    return json_response({
+        'results': [serialize(messages[id]) for id in ids[:per_page]],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(ids) > per_page,
+    })
+
+
+@api_blueprint.route('/tags')
+@conditional('tags')
+def tags():
+    return serialize_all(Tag, tag_schema)
+
+
+@api_blueprint.route('/tags/query')
+@conditional('messages', 'tags')
+def tag_query():
+    # Ids of the messages tagged as in ?q=Japan AND Country NOT Quote
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', current_app.config['TAG_QUERY_PER_PAGE'], type=int)
+    if page < 1 or not 0 < per_page <= current_app.config['TAG_QUERY_MAX_PER_PAGE']:
+        raise BadRequest("Invalid page or per_page")
+    try:
+        tree = parse(request.args.get('q', ''))
+    except ValueError as error:
+        raise BadRequest(str(error))
+    if current_app.config['TAG_INDEX']:
+        ids = tag_index.query(tree, page, per_page)
+    else:
+        ids = query_ids(tree, page, per_page)
+    return json_response({
+        'ids': ids[:per_page],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(ids) > per_page,
+    })
+
+
+@api_blueprint.route('/tags/<int:id>')
+@conditional('tags')
+def tag(id):
+    return serialize_one(Tag, tag_schema, id)
+
+
+@api_blueprint.route('/export/messages')
+@api_login_required
+def export():
+    # Streams the current user's messages as one line of JSON each,
+    # ?after=<id> resumes an export. manage.py export exports everyone's.
+    after = request.args.get('after', 0, type=int)
+    chunks = export_messages(after, current_app.config['EXPORT_BATCH_SIZE'], g.api_user.id)
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson')
+
+
+@api_blueprint.route('/import/messages', methods=['POST'])
+@api_login_required
+def import_():
+    # Imports a body of newline-delimited JSON records as the current user,
+    # see import_messages. Forms cannot send this content type cross-site.
+    if request.mimetype != 'application/x-ndjson':
+        raise UnsupportedMediaType("Expected application/x-ndjson")
+    report = import_messages(request.stream, current_app.config['IMPORT_BATCH_SIZE'],
+                             g.api_user.id)
+    return json_response(report.as_dict())
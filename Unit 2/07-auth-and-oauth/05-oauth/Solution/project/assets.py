@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import time
+
+from flask import current_app, request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fingerprinted copies of the static files are built into static/dist
+BUILD_FOLDER = 'dist'
+MANIFEST = 'manifest.json'
+
+# Files of earlier builds are kept for a week after a build replaces them,
+# for cached pages and workers not yet restarted that still link to them
+SUPERSEDED = 'superseded.json'
+KEEP_SUPERSEDED = 7 * 24 * 60 * 60
+
+# Text files get pre-compressed .gz and .br variants
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.html'}
+
+# Fingerprinted files never change, browsers may keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def build_assets(static_folder, keep=KEEP_SUPERSEDED, now=None):
+    """Copy static files into dist/ under names containing a content hash
+
+    dist/manifest.json maps every original name to its fingerprinted one,
+    e.g. style.css to dist/style.3f2a9c1d04be.css. Text files also get
+    .gz variants and, when brotli is installed, .br variants. Files of
+    earlier builds are removed keep seconds after the build that replaced
+    them, dist/superseded.json records when that was.
+    """
+    build_folder = os.path.join(static_folder, BUILD_FOLDER)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != build_folder]
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                content = f.read()
+            base, extension = os.path.splitext(filename)
+            digest = hashlib.md5(content).hexdigest()[:12]
+            fingerprinted = '%s/%s.%s%s' % (BUILD_FOLDER, base, digest, extension)
+            target = os.path.join(static_folder, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write(target, content)
+            if extension in COMPRESSIBLE:
+                _write(target + '.gz', gzip.compress(content, 9, mtime=0))
+                if brotli:
+                    _write(target + '.br', brotli.compress(content))
+            manifest[filename] = fingerprinted
+    _write(os.path.join(build_folder, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    _prune(static_folder, set(manifest.values()), keep, time.time() if now is None else now)
+    return manifest
+
+
+def _prune(static_folder, current, keep, now):
+    build_folder = os.path.join(static_folder, BUILD_FOLDER)
+    path = os.path.join(build_folder, SUPERSEDED)
+    superseded = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            superseded = json.load(f)
+    remaining = {}
+    for root, dirs, files in os.walk(build_folder):
+        for name in files:
+            filename = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+            built = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+            if built in current or filename in (BUILD_FOLDER + '/' + MANIFEST,
+                                                 BUILD_FOLDER + '/' + SUPERSEDED):
+                continue
+            since = superseded.get(built, now)
+            if now - since >= keep:
+                os.remove(os.path.join(root, name))
+            else:
+                remaining[built] = since
+    _write(path, json.dumps(remaining, indent=2, sort_keys=True).encode())
+
+
+def _write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def init_assets(app):
+    # Without a build url_for('static', ...) keeps the original names
+    path = os.path.join(app.static_folder, BUILD_FOLDER, MANIFEST)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    app.extensions['assets'] = manifest
+    app.url_defaults(fingerprint_url)
+    app.view_functions['static'] = send_static
+
+
+def fingerprint_url(endpoint, values):
+    # Point url_for('static', filename='style.css') to the fingerprinted file
+    if endpoint == 'static':
+        manifest = current_app.extensions['assets']
+        values['filename'] = manifest.get(values.get('filename'), values.get('filename'))
+
+
+def send_static(filename):
+    if not filename.startswith(BUILD_FOLDER + '/'):
+        return current_app.send_static_file(filename)
+
+    # Only files inside the static folder, also when the web server sends them
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    # Serve a pre-compressed variant when the browser accepts it
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            encoding = name
+            filename += suffix
+            break
+
+    prefix = current_app.config['ASSETS_ACCEL_REDIRECT']
+    if prefix:
+        # Let nginx send the file from an internal location
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = prefix + filename
+    else:
+        # USE_X_SENDFILE makes Flask hand the file to Apache or lighttpd
+        response = send_from_directory(current_app.static_folder, filename, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
@@ -0,0 +1,114 @@
+from sqlalchemy.orm import selectinload
+
+from project import db
+from project.messages.models import Message
+from project.tags.models import Tag
+
+# Same limit as the content column
+MAX_CONTENT = 100
+
+
+class BatchError(ValueError):
+    # Raised with the result of every operation when any of them is invalid
+    def __init__(self, results):
+        super().__init__("Invalid operations")
+        self.results = results
+
+
+def apply_operations(user_id, operations, max_operations=1000):
+    """Applies a list of operations to the messages of a user, such as
+
+        [{"op": "create", "content": "Hello", "tags": [1, 2]},
+         {"op": "update", "id": 3, "content": "Hi"},
+         {"op": "delete", "id": 4}]
+
+    All messages and tags referenced are loaded with one query each, and
+    all changes are written with one flush and one commit, so either every
+    operation is applied or none is. Returns one result per operation, in
+    order. If any operation is invalid nothing is written and BatchError
+    is raised with the results, which give the error of each invalid one.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError([{'error': "Expected a list of operations"}])
+    if len(operations) > max_operations:
+        raise BatchError([{'error': "At most %d operations per batch" % max_operations}])
+    messages, tags = _load(user_id, operations)
+
+    results = []
+    deleted = set()
+    for index, operation in enumerate(operations):
+        error = _check(operation, messages, tags, deleted)
+        results.append({'index': index, 'error': error} if error else {'index': index})
+    if any('error' in result for result in results):
+        raise BatchError(results)
+
+    changed = []
+    for operation in operations:
+        op = operation['op']
+        if op == 'create':
+            message = Message(operation['content'], user_id)
+            db.session.add(message)
+        else:
+            message = messages[operation['id']]
+            if op == 'delete':
+                db.session.delete(message)
+                changed.append(message)
+                continue
+            if 'content' in operation:
+                message.content = operation['content']
+        if 'tags' in operation:
+            message.tags = [tags[id] for id in dict.fromkeys(operation['tags'])]
+        changed.append(message)
+
+    db.session.flush()
+    for result, operation, message in zip(results, operations, changed):
+        result.update(op=operation['op'], id=message.id)
+        if operation['op'] != 'delete':
+            result['version'] = message.version
+    db.session.commit()
+    return results
+
+
+def _load(user_id, operations):
+    message_ids, tag_ids = set(), set()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            continue
+        if isinstance(operation.get('id'), int):
+            message_ids.add(operation['id'])
+        if isinstance(operation.get('tags'), list):
+            tag_ids.update(id for id in operation['tags'] if isinstance(id, int))
+    messages, tags = {}, {}
+    if message_ids:
+        # Tags are loaded too, deletes and tag updates change their links
+        query = (Message.query.options(selectinload(Message.tags))
+                 .filter(Message.user_id == user_id, Message.id.in_(message_ids)))
+        messages = {message.id: message for message in query}
+    if tag_ids:
+        tags = {tag.id: tag for tag in Tag.query.filter(Tag.id.in_(tag_ids))}
+    return messages, tags
+
+
+def _check(operation, messages, tags, deleted):
+    if not isinstance(operation, dict):
+        return "Expected an object"
+    op = operation.get('op')
+    if op not in ('create', 'update', 'delete'):
+        return "Unknown operation %r" % (op,)
+    if op != 'create':
+        id = operation.get('id')
+        if not isinstance(id, int) or id not in messages or id in deleted:
+            return "Message %r not found" % (id,)
+        if op == 'delete':
+            deleted.add(id)
+            return None
+    if 'content' in operation or op == 'create':
+        content = operation.get('content')
+        if not isinstance(content, str) or not 0 < len(content) <= MAX_CONTENT:
+            return "Content must be 1 to %d characters" % MAX_CONTENT
+    if 'tags' in operation:
+        tag_ids = operation['tags']
+        if not isinstance(tag_ids, list) or not all(
+                isinstance(id, int) and id in tags for id in tag_ids):
+            return "Tags must be a list of existing tag ids"
+    return None
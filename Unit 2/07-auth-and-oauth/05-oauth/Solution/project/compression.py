@@ -0,0 +1,147 @@
+import itertools
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript',
+                'application/xml', 'application/x-ndjson', 'image/svg+xml')
+
+
+class GzipCompressor(object):
+
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer around the deflate data
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor(object):
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware compressing responses with brotli or gzip
+
+    The encoding is negotiated from Accept-Encoding, brotli is preferred
+    when installed. The body is compressed chunk by chunk as the app
+    yields it, and every chunk is flushed, so streamed responses reach the
+    client incrementally and are never buffered whole. Responses shorter
+    than min_size bytes, already encoded, or of types that do not compress
+    well are passed through untouched.
+    """
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=4):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    def negotiate(self, environ):
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli and accept['br']:
+            return 'br'
+        if accept['gzip']:
+            return 'gzip'
+        return None
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.level)
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.app(environ, start_response)
+
+        response = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+
+        body = self.app(environ, capture)
+        chunks = iter(body)
+        head = []
+        # Generators may only call start_response with their first chunk
+        if not response:
+            for chunk in chunks:
+                head.append(chunk)
+                if response:
+                    break
+        status, headers, exc_info = response
+        headers = Headers(headers)
+        if not self.should_compress(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return _closing(itertools.chain(head, chunks), body)
+
+        # Without a Content-Length, read up to min_size bytes to decide
+        length = headers.get('Content-Length', type=int)
+        if length is None:
+            length = sum(map(len, head))
+            while length < self.min_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                head.append(chunk)
+                length += len(chunk)
+        if length < self.min_size:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return _closing(itertools.chain(head, chunks), body)
+
+        headers['Content-Encoding'] = encoding
+        headers.remove('Content-Length')
+        headers.add('Vary', 'Accept-Encoding')
+        # The compressed body is a different representation of the page
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return _closing(self.compress(encoding, head, chunks), body)
+
+    def should_compress(self, status, headers):
+        return (status.startswith('200') and
+                'Content-Encoding' not in headers and
+                headers.get('Content-Type', '').startswith(COMPRESSIBLE) and
+                'no-transform' not in headers.get('Cache-Control', ''))
+
+    def compress(self, encoding, head, chunks):
+        compressor = self.compressor(encoding)
+        for chunk in head:
+            yield compressor.compress(chunk)
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+
+
+def _closing(iterable, body):
+    # The original body must still be closed, as WSGI requires
+    return ClosingIterator(iterable, getattr(body, 'close', None))
+
+
+def init_compression(app):
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config['COMPRESS_MIN_SIZE'],
+        level=app.config['COMPRESS_LEVEL'],
+        brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'])
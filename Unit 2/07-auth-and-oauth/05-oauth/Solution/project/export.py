@@ -0,0 +1,84 @@
+import itertools
+import json
+import os
+
+from sqlalchemy import select
+
+from project import db
+from project.api.serializers import dumps
+from project.users.models import User
+from project.messages.models import Message, MessageTags
+from project.tags.models import Tag
+
+
+def export_messages(after=0, batch_size=1000, user_id=None):
+    """Yields messages with their author and tags as newline-delimited JSON
+
+    One query joins messages, users and tags through messages_tags and is
+    read from a server-side cursor batch_size rows at a time, so memory
+    stays constant however many messages there are. Messages come in id
+    order, starting after the given id; to resume an export pass the id
+    of the last message exported. Every chunk holds about batch_size lines.
+    With user_id only the messages of that user are exported.
+    """
+    messages, users, tags = Message.__table__, User.__table__, Tag.__table__
+    query = (select([messages.c.id, messages.c.content, messages.c.user_id,
+                     users.c.username, users.c.first_name, users.c.last_name,
+                     tags.c.id.label('tag_id'), tags.c.name.label('tag_name')])
+             .select_from(messages
+                          .outerjoin(users, users.c.id == messages.c.user_id)
+                          .outerjoin(MessageTags, MessageTags.c.message_id == messages.c.id)
+                          .outerjoin(tags, tags.c.id == MessageTags.c.tag_id))
+             .where(messages.c.id > after)
+             .order_by(messages.c.id, MessageTags.c.id))
+    if user_id is not None:
+        query = query.where(messages.c.user_id == user_id)
+    connection = db.engine.connect().execution_options(stream_results=True)
+    try:
+        result = connection.execute(query)
+        rows = itertools.chain.from_iterable(iter(lambda: result.fetchmany(batch_size), []))
+        # Rows of the same message are adjacent, one per tag
+        lines = []
+        for message_id, message_rows in itertools.groupby(rows, key=lambda row: row.id):
+            lines.append(dumps(_message(list(message_rows))))
+            if len(lines) >= batch_size:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+    finally:
+        connection.close()
+
+
+def _message(rows):
+    row = rows[0]
+    user = None
+    if row.user_id is not None:
+        user = {'id': row.user_id, 'username': row.username,
+                'first_name': row.first_name, 'last_name': row.last_name}
+    return {
+        'id': row.id,
+        'content': row.content,
+        'user': user,
+        'tags': [{'id': row.tag_id, 'name': row.tag_name} for row in rows if row.tag_id is not None],
+    }
+
+
+def checkpoint(path):
+    """Returns the id of the last message exported to the file at path
+
+    A last line left incomplete by an interrupted export is cut off, so
+    the export can be resumed by appending the messages after that id.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        # Lines are short, so the last complete one is in the last 64 KB
+        start = max(0, end - 2 ** 16)
+        f.seek(start)
+        tail = f.read()
+        complete = tail.rfind(b'\n') + 1
+        f.truncate(start + complete)
+        lines = tail[:complete].splitlines()
+    return json.loads(lines[-1])['id'] if lines else 0
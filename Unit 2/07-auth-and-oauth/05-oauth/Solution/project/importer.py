@@ -0,0 +1,182 @@
+import json
+import time
+
+from sqlalchemy import select, text
+
+from project import db
+from project.users.models import User
+from project.messages.models import Message, MessageTags
+from project.tags.models import Tag
+from project.versions import bump_versions
+
+# Same limits as the columns
+MAX_CONTENT = 100
+MAX_TAG = 100
+
+# Bound parameters per INSERT, below the limit of PostgreSQL, and below
+# the 999 of SQLite builds older than 3.32
+MAX_PARAMETERS = 30000
+SQLITE_MAX_PARAMETERS = 999
+
+# Rejected records listed in a report, the rest are only counted
+MAX_REJECTED = 1000
+
+
+class ImportReport(object):
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = []
+        self.rejected_count = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def reject(self, line, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED:
+            self.rejected.append({'line': line, 'reason': reason})
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'rejected_count': self.rejected_count,
+            'seconds': round(self.seconds, 3),
+            'messages_per_second': round(self.imported / self.seconds) if self.seconds else 0,
+        }
+
+
+def import_messages(lines, batch_size=5000, user_id=None):
+    """Imports messages from lines of JSON such as
+
+        {"user": "eschoppik", "content": "Hello", "tags": ["Greeting"]}
+
+    where user is a username or an id. With user_id every message is that
+    user's: user may be left out, and records naming another user are
+    rejected. Every batch_size valid records are written in one
+    transaction: missing tags, then the messages, then their messages_tags
+    rows, each with multi-row INSERTs. Tags are resolved through a name to
+    id map loaded once. Invalid records are skipped and listed in the
+    report with their line number, the first MAX_REJECTED of them.
+    """
+    report = ImportReport()
+    users, tags = _users(), _tags()
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        record = _parse(number, line, users, report, user_id)
+        if record:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            _write(batch, tags, report)
+            batch = []
+    if batch:
+        _write(batch, tags, report)
+    report.seconds = time.perf_counter() - report.started
+    return report
+
+
+def _users():
+    table = User.__table__
+    users = {}
+    for id, username in db.engine.execute(select([table.c.id, table.c.username])):
+        users[id] = id
+        users[username] = id
+    return users
+
+
+def _tags():
+    # With duplicate names the first tag wins, like the HTML forms
+    table = Tag.__table__
+    tags = {}
+    for id, name in db.engine.execute(select([table.c.id, table.c.name]).order_by(table.c.id)):
+        tags.setdefault(name, id)
+    return tags
+
+
+def _parse(number, line, users, report, user_id=None):
+    try:
+        record = json.loads(line)
+        user = record['user'] if user_id is None else record.get('user', user_id)
+        content, tag_names = record['content'], record.get('tags', [])
+    except (ValueError, TypeError, KeyError) as error:
+        report.reject(number, "Invalid record: %s" % error)
+        return None
+    if not isinstance(user, (int, str)) or user not in users:
+        report.reject(number, "Unknown user %r" % (user,))
+    elif user_id is not None and users[user] != user_id:
+        report.reject(number, "Messages can only be imported as user %d" % user_id)
+    elif not isinstance(content, str) or not 0 < len(content) <= MAX_CONTENT:
+        report.reject(number, "Content must be 1 to %d characters" % MAX_CONTENT)
+    elif not isinstance(tag_names, list) or not all(
+            isinstance(name, str) and 0 < len(name) <= MAX_TAG for name in tag_names):
+        report.reject(number, "Tags must be names of 1 to %d characters" % MAX_TAG)
+    else:
+        # Keep the order of the tags, without repeats
+        return users[user], content, list(dict.fromkeys(tag_names))
+    return None
+
+
+def _write(batch, tags, report):
+    tags_table = Tag.__table__
+    with db.engine.begin() as connection:
+        new_tags = list(dict.fromkeys(
+            name for _, _, names in batch for name in names if name not in tags))
+        if new_tags:
+            _insert(connection, tags_table, [{'name': name, 'version': 1} for name in new_tags])
+            query = select([tags_table.c.id, tags_table.c.name]).where(
+                tags_table.c.name.in_(new_tags)).order_by(tags_table.c.id)
+            for id, name in connection.execute(query):
+                tags.setdefault(name, id)
+
+        ids = _insert_messages(connection, [
+            {'user_id': user_id, 'content': content, 'version': 1}
+            for user_id, content, _ in batch], [bool(names) for _, _, names in batch])
+        links = [{'message_id': id, 'tag_id': tags[name]}
+                 for id, (_, _, names) in zip(ids, batch) for name in names]
+        _insert(connection, MessageTags, links)
+        bump_versions(connection, ['messages', 'tags'] if new_tags else ['messages'])
+    report.imported += len(batch)
+
+
+def _chunks(connection, rows):
+    limit = SQLITE_MAX_PARAMETERS if connection.dialect.name == 'sqlite' else MAX_PARAMETERS
+    size = limit // len(rows[0])
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert(connection, table, rows):
+    if rows:
+        for chunk in _chunks(connection, rows):
+            connection.execute(table.insert().values(chunk))
+
+
+def _insert_messages(connection, rows, tagged):
+    # Returns the ids of the inserted rows, in order. Outside PostgreSQL
+    # only the rows with tags get theirs, the others get None.
+    messages = Message.__table__
+    ids = []
+    if connection.dialect.name == 'postgresql':
+        # RETURNING does not promise the order of VALUES, so the ids are
+        # taken from the sequence first and inserted with the rows
+        ids = [id for id, in connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence('messages', 'id')) "
+                 "FROM generate_series(1, :count)"), count=len(rows))]
+        _insert(connection, messages, [dict(row, id=id) for row, id in zip(rows, ids)])
+        return ids
+    # Other databases do not promise the ids of a multi-row INSERT, e.g.
+    # MySQL reports the first one and may interleave concurrent inserts, so
+    # rows with tags are inserted one at a time between runs of the others
+    untagged = []
+    for row, has_tags in zip(rows, tagged):
+        if not has_tags:
+            untagged.append(row)
+            ids.append(None)
+            continue
+        _insert(connection, messages, untagged)
+        untagged = []
+        ids.append(connection.execute(messages.insert(), row).inserted_primary_key[0])
+    _insert(connection, messages, untagged)
+    return ids
@@ -10,7 +10,12 @@ MessageTags = db.Table('messages_tags',
                                  db.ForeignKey('messages.id', ondelete="cascade")),
                        db.Column('tag_id',
                                  db.Integer,
-                                 db.ForeignKey('tags.id', ondelete="cascade")))
+                                 db.ForeignKey('tags.id', ondelete="cascade"),
+                                 index=True),
+                       # Link a tag to a message once, the index also serves
+                       # lookups by message_id
+                       db.Index('ix_messages_tags_message_id_tag_id',
+                                'message_id', 'tag_id', unique=True))
 
 
 class Message(db.Model):
@@ -19,9 +24,11 @@ class Message(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(100))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     tags = db.relationship('Tag', secondary=MessageTags,
                            backref=db.backref('messages'))
+    # Incremented on every update, including changes to tags
+    version = db.Column(db.Integer, nullable=False, default=1)
 
     def __init__(self, content, user_id):
         self.content = content
@@ -1,10 +1,11 @@
 from flask import Blueprint, render_template, url_for, request, redirect, flash
 
-from project import app, db
+from project import db
 from project.messages.forms import MessageForm, DeleteForm
 from project.users.models import User
 from project.messages.models import Message
 from project.helpers import not_loggedin_required, current_user_required
+from project.versions import conditional
 
 from flask_login import login_required
 
@@ -12,14 +13,15 @@ messages_blueprint = Blueprint(
     'messages', __name__, template_folder='templates')
 
 
-# View all messages
-@app.route('/messages')
+# View all messages, registered at /messages by create_app
+@conditional('messages', 'users', 'tags')
 def messages_index():
-    return render_template('messages/messages_index.html', messages=Message.query.all())
+    return render_template('messages/messages_index.html', messages=Message.query)
 
 
 # See all messages for user
 @messages_blueprint.route('/', methods=["GET", "POST"])
+@conditional('messages', 'users', 'tags')
 def messages(user_id):
     if request.method == "POST":
         form = MessageForm(request.form)
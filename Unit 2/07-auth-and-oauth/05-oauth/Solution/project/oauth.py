@@ -0,0 +1,108 @@
+from flask import flash
+from flask_login import current_user, login_user
+from flask_dance.contrib.twitter import make_twitter_blueprint
+from flask_dance.consumer import oauth_authorized
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from sqlalchemy.orm.exc import NoResultFound
+
+from project import db
+from project.users.models import User
+
+
+class OAuth(OAuthConsumerMixin, db.Model):
+    # Maximum length of Twitter username is 15 characters
+    twitter_username = db.Column(db.String(15), unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), index=True)
+    user = db.relationship(User)
+
+
+def init_oauth(app):
+    # Configure Flask Dance
+    twitter_blueprint = make_twitter_blueprint(
+        api_key=app.config['TWITTER_API_KEY'],
+        api_secret=app.config['TWITTER_API_SECRET'],
+    )
+    twitter_blueprint.backend = SQLAlchemyBackend(
+        OAuth, db.session, user=current_user, user_required=False)
+    oauth_authorized.connect(twitter_logged_in, sender=twitter_blueprint)
+    app.register_blueprint(twitter_blueprint, url_prefix="/login")
+
+
+def twitter_logged_in(twitter_blueprint, token):
+    if not token:
+        flash("Failed to log in with Twitter.", category="error")
+        return False
+
+    resp = twitter_blueprint.session.get("account/settings.json")
+
+    if not resp.ok:
+        msg = "Failed to fetch user info from Twitter."
+        flash(msg, category="error")
+        return False
+
+    twitter_info = resp.json()
+    twitter_username = twitter_info['screen_name']
+
+    # Find this OAuth token in the database, or create it
+    query = OAuth.query.filter_by(
+        provider=twitter_blueprint.name,
+        twitter_username=twitter_username,
+    )
+    try:
+        # Existing OAuth token in database
+        oauth = query.one()
+    except NoResultFound:
+        # Create new OAuth token
+        oauth = OAuth(
+            provider=twitter_blueprint.name,
+            twitter_username=twitter_username,
+            token=token,
+        )
+
+    # If the token is associated with a user (?), log the user in
+    if oauth.user:
+        login_user(oauth.user)
+        flash("Successfully signed in with Twitter.")
+    else:
+        """
+        # Successful OAuth authentication without adding OAuth to existing non-OAuth accounts
+        # Create a new local user account for this user
+        user = User(
+            first_name=twitter_username,
+            # Less secure, but no username is generated, so on its own password cannot be used to log in
+            password='password'
+        )
+        # Associate the new local user account with the OAuth token
+        oauth.user = user
+        # Save and commit our database models
+        db.session.add_all([user, oauth])
+        db.session.commit()
+        # Log in the new local user account
+        login_user(user)
+        flash("Successfully signed in with Twitter.")
+        """
+
+        # If user account already exists but there is no associated OAuth token
+        if current_user.is_authenticated:
+            oauth.user = current_user
+            db.session.add(oauth)
+            db.session.commit()
+            flash("Successfully linked Twitter account.")
+        else:
+            # Create a new local user account for this user
+            user = User(
+                first_name=twitter_username,
+                # Less secure, but no username is generated, so on its own password cannot be used to log in
+                password='password'
+            )
+            # Associate the new local user account with the OAuth token
+            oauth.user = user
+            # Save and commit our database models
+            db.session.add_all([user, oauth])
+            db.session.commit()
+            # Log in the new local user account
+            login_user(user)
+            flash("Successfully signed in with Twitter.")
+
+    # Disable Flask-Dance's default behavior for saving the OAuth token
+    return False
@@ -0,0 +1,163 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, g, request
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit):
+    # "10/minute" is 10 requests per 60 seconds
+    count, period = limit.split('/')
+    return int(count), PERIODS[period]
+
+
+class TokenBuckets(object):
+    """Token buckets kept in memory, for a single process
+
+    Every key has a bucket of count tokens refilled at count per period;
+    a request takes one token. Updating a bucket is a few float operations,
+    done under one short lock like FragmentCache. Beyond max_keys the
+    buckets of the least recently seen keys are dropped.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def hit(self, key, count, period, now=None):
+        # Returns whether the request is allowed, the tokens left and the
+        # seconds until the next token
+        now = time.monotonic() if now is None else now
+        rate = count / period
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (count, now, period))
+            tokens = min(count, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, period)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, int(tokens), 0 if allowed else (1 - tokens) / rate
+
+
+class SharedCounters(object):
+    """Fixed window counters in a store shared by all processes and nodes
+
+    The store needs incr(key, amount) and expire(key, seconds), e.g. a
+    redis.Redis client. Every window of period seconds allows count
+    requests; counters expire with their window.
+    """
+
+    def __init__(self, store, prefix='ratelimit:'):
+        self.store = store
+        self.prefix = prefix
+
+    def hit(self, key, count, period, now=None):
+        now = time.time() if now is None else now
+        window = int(now // period)
+        counter = f"{self.prefix}{key}:{window}"
+        hits = self.store.incr(counter, 1)
+        if hits == 1:
+            self.store.expire(counter, period)
+        allowed = hits <= count
+        return allowed, max(0, count - hits), 0 if allowed else (window + 1) * period - now
+
+
+class MemoryStore(object):
+    # The subset of the redis client used by SharedCounters, for tests and
+    # single node development
+
+    def __init__(self):
+        self._values = {}
+        self._expires = {}
+        self._lock = Lock()
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            if self._expires.get(key, float('inf')) <= time.time():
+                self._values.pop(key, None)
+                self._expires.pop(key, None)
+            self._values[key] = self._values.get(key, 0) + amount
+            return self._values[key]
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self._expires[key] = time.time() + seconds
+
+
+class RateLimiter(object):
+    """Limits requests per client to the routes in app.config['RATELIMITS']
+
+    RATELIMITS maps endpoints ('users.login') or blueprints ('api') to
+    limits such as '10/minute'; an endpoint's limit replaces its
+    blueprint's. Only methods in RATELIMIT_METHODS count. Clients are told
+    apart by their address, which behind reverse proxies is only right when
+    PROXY_COUNT says how many to trust. Clients are told their limit and
+    remaining requests in X-RateLimit-* headers, and get 429 Too Many
+    Requests with Retry-After once it is used up, before the view runs any
+    password hashing.
+    """
+
+    def __init__(self, app=None):
+        self.allowed = {}
+        self.limited = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        store = app.config['RATELIMIT_STORE']
+        app.extensions['ratelimit'] = SharedCounters(store) if store else TokenBuckets()
+        app.before_request(self.check)
+        app.after_request(self.add_headers)
+
+    def limit_for(self, endpoint, blueprint):
+        limits = current_app.config['RATELIMITS']
+        name = endpoint if endpoint in limits else blueprint
+        if name not in limits:
+            return None, None
+        return name, limits[name]
+
+    def check(self):
+        config = current_app.config
+        # Flask Modus makes overridden methods bytes literals
+        method = request.method
+        if isinstance(method, bytes):
+            method = method.decode('ascii')
+        if not config['RATELIMIT_ENABLED'] or method not in config['RATELIMIT_METHODS']:
+            return
+        name, limit = self.limit_for(request.endpoint, request.blueprint)
+        if name is None:
+            return
+        count, period = parse_limit(limit)
+        backend = current_app.extensions['ratelimit']
+        allowed, remaining, retry_after = backend.hit(f"{name}:{request.remote_addr}", count, period)
+        g.ratelimit = (count, remaining)
+        counters = self.allowed if allowed else self.limited
+        with self._lock:
+            counters[name] = counters.get(name, 0) + 1
+        if not allowed:
+            response = current_app.response_class(
+                "Too many requests, try again later", status=TooManyRequests.code)
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response
+
+    def add_headers(self, response):
+        if 'ratelimit' in g:
+            count, remaining = g.ratelimit
+            response.headers['X-RateLimit-Limit'] = str(count)
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+        return response
+
+    def stats(self):
+        # Requests allowed and refused per limited endpoint or blueprint
+        with self._lock:
+            return {name: {'allowed': self.allowed.get(name, 0),
+                           'limited': self.limited.get(name, 0)}
+                    for name in set(self.allowed) | set(self.limited)}
@@ -0,0 +1,73 @@
+import re
+
+from sqlalchemy import DDL, event, text
+
+from project import db
+from project.messages.models import Message
+
+# PostgreSQL keeps a tsvector of every message in a generated column, so
+# writes from the ORM, bulk imports and psql all update it, and searches
+# it through a GIN index
+POSTGRESQL = [
+    "ALTER TABLE messages ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    "(to_tsvector('english', coalesce(content, ''))) STORED",
+    "CREATE INDEX ix_messages_search_vector ON messages USING GIN (search_vector)",
+]
+
+# SQLite, used by the tests, indexes messages in an FTS5 table whose rows
+# are kept in step with messages by triggers
+SQLITE = [
+    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+]
+
+for statement in POSTGRESQL:
+    event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE:
+    event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Message.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect='sqlite'))
+
+
+def create_index(connection):
+    # Adds the index to a database created before search existed
+    statements = POSTGRESQL if connection.dialect.name == 'postgresql' else SQLITE
+    for statement in statements:
+        connection.execute(text(statement))
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"))
+
+
+def search_messages(query, page=1, per_page=20):
+    """Returns the ids of the messages matching every word of query
+
+    The ids come best match first, one page at a time, with one more id
+    than per_page when there is a next page. Matches are not counted, so
+    a page costs the same however many messages match.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return []
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        sql = ("SELECT id FROM messages, plainto_tsquery('english', :query) query "
+               "WHERE search_vector @@ query "
+               "ORDER BY ts_rank(search_vector, query) DESC, id "
+               "LIMIT :limit OFFSET :offset")
+        params['query'] = ' '.join(words)
+    else:
+        # Quoted words are matched as words, whatever the FTS5 query syntax
+        sql = ("SELECT rowid FROM messages_fts WHERE messages_fts MATCH :query "
+               "ORDER BY rank, rowid LIMIT :limit OFFSET :offset")
+        params['query'] = ' '.join('"%s"' % word for word in words)
+    return [id for id, in connection.execute(text(sql), params)]
@@ -0,0 +1,319 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import and_, event, inspect, not_, or_, select
+
+from project import db
+from project.messages.models import Message, MessageTags
+from project.tags.models import Tag
+from project.versions import TableVersion, table_versions
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+TOKENS = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+# Limits on expressions, which are parsed and evaluated recursively
+MAX_LENGTH = 1000
+MAX_TAGS = 100
+MAX_DEPTH = 20
+
+
+def parse(expression):
+    """Parses a boolean expression of tag names into a tree of tuples
+
+    'Japan AND Country NOT Quote' gives
+    ('and', ('and', ('tag', 'Japan'), ('tag', 'Country')), ('not', ('tag', 'Quote'))).
+    Adjacent terms are joined with AND, AND binds tighter than OR, and
+    names with spaces or named like the operators are quoted: "New York".
+    Raises ValueError for expressions that do not parse or are longer than
+    MAX_LENGTH characters, name more than MAX_TAGS tags or nest parentheses
+    and NOTs deeper than MAX_DEPTH.
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    if len(expression) > MAX_LENGTH:
+        raise ValueError("Expression longer than %d characters" % MAX_LENGTH)
+    while position < len(expression):
+        match = TOKENS.match(expression, position)
+        if match is None:
+            raise ValueError("Unbalanced quotes")
+        opening, closing, quoted, word = match.groups()
+        if opening or closing:
+            tokens.append(opening or closing)
+        elif quoted is not None:
+            tokens.append(('tag', quoted))
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append(word)
+        else:
+            tokens.append(('tag', word))
+        position = match.end()
+    if not tokens:
+        raise ValueError("Empty expression")
+    if sum(isinstance(token, tuple) for token in tokens) > MAX_TAGS:
+        raise ValueError("More than %d tags" % MAX_TAGS)
+    tree, position = _or(tokens, 0, 0)
+    if position != len(tokens):
+        raise ValueError("Unexpected %r" % (tokens[position],))
+    return tree
+
+
+def _or(tokens, position, depth):
+    left, position = _and(tokens, position, depth)
+    while position < len(tokens) and tokens[position] == 'OR':
+        right, position = _and(tokens, position + 1, depth)
+        left = ('or', left, right)
+    return left, position
+
+
+def _and(tokens, position, depth):
+    left, position = _not(tokens, position, depth)
+    while position < len(tokens) and tokens[position] not in ('OR', ')'):
+        if tokens[position] == 'AND':
+            position += 1
+        right, position = _not(tokens, position, depth)
+        left = ('and', left, right)
+    return left, position
+
+
+def _not(tokens, position, depth):
+    if position == len(tokens):
+        raise ValueError("Unexpected end of expression")
+    token = tokens[position]
+    if token in ('NOT', '(') and depth == MAX_DEPTH:
+        raise ValueError("Nested deeper than %d" % MAX_DEPTH)
+    if token == 'NOT':
+        operand, position = _not(tokens, position + 1, depth + 1)
+        return ('not', operand), position
+    if token == '(':
+        tree, position = _or(tokens, position + 1, depth + 1)
+        if position == len(tokens) or tokens[position] != ')':
+            raise ValueError("Missing )")
+        return tree, position + 1
+    if isinstance(token, tuple):
+        return token, position + 1
+    raise ValueError("Unexpected %r" % (token,))
+
+
+def tag_names(tree):
+    if tree[0] == 'tag':
+        return {tree[1]}
+    return set().union(*(tag_names(operand) for operand in tree[1:]))
+
+
+def _condition(tree):
+    if tree[0] == 'tag':
+        tags = Tag.__table__
+        linked = (select([MessageTags.c.message_id])
+                  .select_from(MessageTags.join(tags, tags.c.id == MessageTags.c.tag_id))
+                  .where(and_(tags.c.name == tree[1], MessageTags.c.message_id.isnot(None))))
+        return Message.__table__.c.id.in_(linked)
+    if tree[0] == 'not':
+        return not_(_condition(tree[1]))
+    return (and_ if tree[0] == 'and' else or_)(*(_condition(operand) for operand in tree[1:]))
+
+
+def query_ids(tree, page=1, per_page=100):
+    # The ids of a page of matching messages from one SQL query, with one id
+    # more than per_page when there is a next page
+    messages = Message.__table__
+    query = (select([messages.c.id]).where(_condition(tree)).order_by(messages.c.id)
+             .limit(per_page + 1).offset((page - 1) * per_page))
+    return [id for id, in db.session.execute(query)]
+
+
+class TagIndex(object):
+    """Bitmaps of the ids of the messages of recently queried tags
+
+    Bitmaps are pyroaring BitMaps when it is installed, else sets. They
+    reflect the messages and tags tables at the versions in self.versions;
+    commits from this process update them in place, and a write by another
+    process changes the table versions, which clears them. At most
+    max_tags tags are kept, the least recently queried are dropped first.
+    """
+
+    def __init__(self, max_tags=64):
+        self.max_tags = max_tags
+        self.versions = None
+        self._all = None
+        self._tags = OrderedDict()
+        self._lock = Lock()
+
+    def clear(self):
+        with self._lock:
+            self.versions = None
+            self._all = None
+            self._tags.clear()
+
+    def _bitmap(self, ids):
+        return BitMap(ids) if BitMap else set(ids)
+
+    def _load(self, names):
+        # Reads the bitmaps of tags not in the index, all in one query
+        if not names:
+            return {}
+        tags = Tag.__table__
+        query = (select([tags.c.name, MessageTags.c.message_id])
+                 .select_from(MessageTags.join(tags, tags.c.id == MessageTags.c.tag_id))
+                 .where(and_(tags.c.name.in_(names), MessageTags.c.message_id.isnot(None))))
+        ids = {name: [] for name in names}
+        for name, message_id in db.session.execute(query):
+            ids[name].append(message_id)
+        return {name: self._bitmap(message_ids) for name, message_ids in ids.items()}
+
+    def query(self, tree, page=1, per_page=100):
+        """Returns a page of the ids of the messages matching tree
+
+        Like query_ids, but evaluated on the bitmaps, which are loaded
+        first for tags missing from the index.
+        """
+        names = tag_names(tree)
+        versions = tuple(table_versions().get(name, (0,))[0] for name in ('messages', 'tags'))
+        if versions != self.versions:
+            self.clear()
+        loaded = self._load([name for name in names if name not in self._tags])
+        # Every message id is only needed to negate, as in NOT Quote
+        universe = self._all
+        if universe is None and _negates(tree):
+            universe = self._bitmap(id for id, in db.session.execute(
+                select([Message.__table__.c.id])))
+        with self._lock:
+            if self.versions is None:
+                self.versions = versions
+            if self.versions == versions:
+                self._tags.update(loaded)
+                if self._all is None:
+                    self._all = universe
+            bitmaps = {name: loaded.get(name, self._tags.get(name)) for name in names}
+            if None in bitmaps.values():
+                result = None
+            else:
+                for name in names:
+                    if name in self._tags:
+                        self._tags.move_to_end(name)
+                while len(self._tags) > self.max_tags:
+                    self._tags.popitem(last=False)
+                result = _evaluate(tree, bitmaps, universe)
+        if result is None:
+            # Another request dropped a tag in the meantime
+            return self.query(tree, page, per_page)
+        start = (page - 1) * per_page
+        if BitMap:
+            return list(result[start:start + per_page + 1])
+        return sorted(result)[start:start + per_page + 1]
+
+    def apply(self, changes, bumps):
+        """Applies the changes committed by this process
+
+        changes are ('add', message_id, tag names), ('remove', message_id),
+        ('link', message_id, name), ('unlink', message_id, name) or
+        ('clear', None); bumps counts the version bumps of the messages and
+        tags tables by the commit. The table versions are read again, so
+        a write interleaved from another process clears the index.
+        """
+        if self.versions is None:
+            return
+        table = TableVersion.__table__
+        with db.engine.connect() as connection:
+            current = dict(connection.execute(
+                select([table.c.name, table.c.version])
+                .where(table.c.name.in_(['messages', 'tags']))).fetchall())
+        versions = (current.get('messages', 0), current.get('tags', 0))
+        with self._lock:
+            expected = (self.versions[0] + bumps.get('messages', 0),
+                        self.versions[1] + bumps.get('tags', 0))
+            if versions != expected or any(change[0] == 'clear' for change in changes):
+                self.versions = None
+                self._all = None
+                self._tags.clear()
+                return
+            for change in changes:
+                kind, message_id = change[0], change[1]
+                if kind == 'add':
+                    if self._all is not None:
+                        self._all.add(message_id)
+                    for name in change[2]:
+                        if name in self._tags:
+                            self._tags[name].add(message_id)
+                elif kind == 'remove':
+                    if self._all is not None:
+                        self._all.discard(message_id)
+                    for bitmap in self._tags.values():
+                        bitmap.discard(message_id)
+                elif change[2] in self._tags:
+                    if kind == 'link':
+                        self._tags[change[2]].add(message_id)
+                    else:
+                        self._tags[change[2]].discard(message_id)
+            self.versions = versions
+
+
+def _negates(tree):
+    if tree[0] == 'tag':
+        return False
+    return tree[0] == 'not' or any(_negates(operand) for operand in tree[1:])
+
+
+def _evaluate(tree, bitmaps, universe):
+    kind = tree[0]
+    if kind == 'tag':
+        return bitmaps[tree[1]]
+    if kind == 'not':
+        return universe - _evaluate(tree[1], bitmaps, universe)
+    left, right = tree[1], tree[2]
+    if kind == 'and':
+        # A AND NOT B is A minus B, without building NOT B
+        if right[0] == 'not':
+            return _evaluate(left, bitmaps, universe) - _evaluate(right[1], bitmaps, universe)
+        if left[0] == 'not':
+            return _evaluate(right, bitmaps, universe) - _evaluate(left[1], bitmaps, universe)
+        return _evaluate(left, bitmaps, universe) & _evaluate(right, bitmaps, universe)
+    return _evaluate(left, bitmaps, universe) | _evaluate(right, bitmaps, universe)
+
+
+tag_index = TagIndex()
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_tag_changes(session, flush_context):
+    # Changes to messages and their tags, applied to tag_index on commit
+    changes = session.info.setdefault('tag_changes', [])
+    bumps = session.info.setdefault('tag_bumps', {})
+    tables = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Message):
+            tables.add('messages')
+            if obj in session.new:
+                changes.append(('add', obj.id, [tag.name for tag in obj.tags]))
+            elif obj in session.deleted:
+                changes.append(('remove', obj.id))
+            else:
+                history = inspect(obj).attrs.tags.history
+                changes.extend(('link', obj.id, tag.name) for tag in history.added or ())
+                changes.extend(('unlink', obj.id, tag.name) for tag in history.deleted or ())
+        elif isinstance(obj, Tag):
+            tables.add('tags')
+            # Links are recorded on the message side, and new tags have no
+            # messages yet; renamed or deleted tags are simpler to reload
+            if obj in session.deleted or inspect(obj).attrs.name.history.deleted:
+                changes.append(('clear', None))
+    for name in tables:
+        bumps[name] = bumps.get(name, 0) + 1
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_tag_changes(session):
+    changes = session.info.pop('tag_changes', None)
+    bumps = session.info.pop('tag_bumps', None)
+    if changes or bumps:
+        tag_index.apply(changes or [], bumps or {})
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_tag_changes(session):
+    session.info.pop('tag_changes', None)
+    session.info.pop('tag_bumps', None)
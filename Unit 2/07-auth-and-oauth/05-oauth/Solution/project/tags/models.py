@@ -6,7 +6,10 @@ class Tag(db.Model):
     __tablename__ = "tags"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100))
+    # Indexed for imports and tag queries, which look tags up by name
+    name = db.Column(db.String(100), index=True)
+    # Incremented on every update, including changes to messages
+    version = db.Column(db.Integer, nullable=False, default=1)
 
     def __init__(self, name):
         self.name = name
@@ -3,11 +3,13 @@ from flask import Blueprint, render_template, url_for, request, redirect, flash
 from project import db
 from project.tags.forms import TagForm, DeleteForm
 from project.tags.models import Tag
+from project.versions import conditional
 
 tags_blueprint = Blueprint('tags', __name__, template_folder='templates')
 
 
 @tags_blueprint.route('/', methods=["GET", "POST"])
+@conditional('tags', 'messages')
 def tags():
     if request.method == "POST":
         form = TagForm(request.form)
@@ -19,7 +21,7 @@ def tags():
         else:
             flash("Form Error: Tag Not Created")
             return render_template('tags/new.html', form=form)
-    return render_template('tags/index.html', tags=Tag.query.all())
+    return render_template('tags/index.html', tags=Tag.query)
 
 
 @tags_blueprint.route('/new', methods=["GET"])
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Lock
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+
+def init_template_cache(app):
+    # Store compiled templates on disk so every worker (and every restart)
+    # can load the bytecode instead of compiling the template source again
+    # TEMPLATE_CACHE_DIR of None uses Jinja's default per-user temp folder
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+        app.config.get('TEMPLATE_CACHE_DIR'))
+
+
+def warm_templates(app):
+    # Compile every template of the app and its blueprints up front so the
+    # first requests served by a worker do not pay for template compilation
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+class FragmentCache(object):
+    """LRU cache of rendered template fragments, bounded by total length"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            if key in self._fragments:
+                self.size -= len(self._fragments.pop(key))
+            self._fragments[key] = fragment
+            self.size += len(fragment)
+            # Evict the least recently used fragments
+            while self.size > self.max_size and self._fragments:
+                self.size -= len(self._fragments.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self.size = self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': len(self._fragments),
+            'size': self.size,
+        }
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache key, ... %} ... {% endcache %} to templates
+
+    The rendered body is reused for as long as the key is the same, so the
+    key must contain everything the body depends on, e.g. row versions.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache(2 ** 20))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.Tuple(key, 'load')]),
+            [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+
+def init_fragment_cache(app):
+    # FRAGMENT_CACHE_MAX_SIZE is the total length of the cached fragments
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache.max_size = app.config['FRAGMENT_CACHE_MAX_SIZE']
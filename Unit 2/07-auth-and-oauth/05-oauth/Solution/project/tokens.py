@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, request
+from flask_login import current_user
+from flask_wtf.csrf import ValidationError, validate_csrf
+from werkzeug.exceptions import BadRequest, Unauthorized
+
+from project import db
+
+# Everything the API needs to know about the user, read from the token claims
+TokenUser = namedtuple('TokenUser', ['id', 'name'])
+
+HEADER = {'alg': 'HS256', 'typ': 'JWT'}
+
+# Methods a logged in session may call without a CSRF token
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class RevokedToken(db.Model):
+
+    __tablename__ = "revoked_tokens"
+
+    # Refresh tokens logged out or rotated before they expire, by token id.
+    # Rows can be removed once expires_at has passed.
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _signature(signing_input, key):
+    return hmac.new(key.encode(), signing_input, hashlib.sha256).digest()
+
+
+def encode(claims, key):
+    # A compact JWT signed with HMAC SHA256
+    segments = [_b64encode(json.dumps(HEADER, separators=(',', ':')).encode()),
+                _b64encode(json.dumps(claims, separators=(',', ':')).encode())]
+    signing_input = b'.'.join(segments)
+    return b'.'.join([signing_input, _b64encode(_signature(signing_input, key))]).decode()
+
+
+def decode(token, key, expected_type):
+    """Returns the claims of a token signed with key
+
+    Raises InvalidToken when the token is malformed, the signature does not
+    match, it has expired or it is not of the expected type ('access' or
+    'refresh'). Only the signature and the claims are checked, nothing is
+    read from the database.
+    """
+    try:
+        signing_input, signature = token.encode('ascii').rsplit(b'.', 1)
+        header, payload = signing_input.split(b'.')
+        if not hmac.compare_digest(_b64decode(signature), _signature(signing_input, key)):
+            raise InvalidToken("Invalid signature")
+        # The header is signed too, so only tokens issued here get this far
+        if json.loads(_b64decode(header)) != HEADER:
+            raise InvalidToken("Unsupported token")
+        claims = json.loads(_b64decode(payload))
+        expired = claims['exp'] <= time.time()
+    except (ValueError, TypeError, KeyError) as error:
+        raise InvalidToken("Malformed token") from error
+    if claims.get('type') != expected_type:
+        raise InvalidToken("Expected an %s token" % expected_type)
+    if expired:
+        raise InvalidToken("Token expired")
+    return claims
+
+
+def issue_tokens(user):
+    # A short-lived access token and a long-lived refresh token for the user
+    config = current_app.config
+    now = int(time.time())
+    access = {'type': 'access', 'sub': user.id,
+              'name': f"{user.first_name} {user.last_name}",
+              'iat': now, 'exp': now + config['JWT_ACCESS_TTL']}
+    refresh = dict(access, type='refresh', jti=uuid.uuid4().hex,
+                   exp=now + config['JWT_REFRESH_TTL'])
+    return {
+        'access_token': encode(access, config['SECRET_KEY']),
+        'refresh_token': encode(refresh, config['SECRET_KEY']),
+        'token_type': 'Bearer',
+        'expires_in': config['JWT_ACCESS_TTL'],
+    }
+
+
+def refresh_claims(token):
+    # Refreshing is rare, so unlike access tokens it checks the revocation list
+    claims = decode(token, current_app.config['SECRET_KEY'], 'refresh')
+    if RevokedToken.query.get(claims['jti']) is not None:
+        raise InvalidToken("Token revoked")
+    return claims
+
+
+def revoke(claims):
+    now = datetime.utcnow()
+    RevokedToken.query.filter(RevokedToken.expires_at < now).delete()
+    db.session.merge(RevokedToken(jti=claims['jti'],
+                                  expires_at=datetime.utcfromtimestamp(claims['exp'])))
+    db.session.commit()
+
+
+def api_login_required(fn):
+    """Requires an access token, or else a logged in Flask-Login session
+
+    With an "Authorization: Bearer <token>" header the user is read from
+    the verified claims, so no session or user row is loaded. Browsers
+    send the session cookie with cross-site requests too, so a session
+    only authenticates methods other than GET and HEAD together with the
+    CSRF token of the session's forms in an X-CSRFToken header, unless
+    WTF_CSRF_ENABLED is off. Either way g.api_user is a TokenUser.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            try:
+                claims = decode(authorization[7:], current_app.config['SECRET_KEY'], 'access')
+            except InvalidToken as error:
+                raise Unauthorized(str(error))
+            g.api_user = TokenUser(claims['sub'], claims['name'])
+        elif current_user.is_authenticated:
+            # Flask Modus makes overridden methods bytes literals
+            method = request.method
+            if isinstance(method, bytes):
+                method = method.decode('ascii')
+            if method not in SAFE_METHODS and current_app.config.get('WTF_CSRF_ENABLED', True):
+                try:
+                    validate_csrf(request.headers.get('X-CSRFToken'))
+                except ValidationError as error:
+                    raise BadRequest(str(error))
+            g.api_user = TokenUser(current_user.id,
+                                   f"{current_user.first_name} {current_user.last_name}")
+        else:
+            raise Unauthorized("Authentication required")
+        return fn(*args, **kwargs)
+    return wrapper
@@ -1,6 +1,5 @@
-from project import db, bcrypt, twitter_blueprint
-from flask_login import UserMixin, current_user
-from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from project import db, bcrypt
+from flask_login import UserMixin
 
 
 class User(db.Model, UserMixin):
@@ -40,13 +39,3 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"User {self.first_name} {self.last_name}"
 
-
-class OAuth(OAuthConsumerMixin, db.Model):
-    # Maximum length of Twitter username is 15 characters
-    twitter_username = db.Column(db.String(15), unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    user = db.relationship(User)
-
-
-twitter_blueprint.backend = SQLAlchemyBackend(
-    OAuth, db.session, user=current_user, user_required=False)
@@ -1,101 +1,17 @@
 from flask import Blueprint, render_template, url_for, request, redirect, flash, session
 
-from project import db, app, bcrypt, twitter_blueprint
+from project import db, bcrypt
 from project.users.forms import UserForm, LoginForm, DeleteForm
-from project.users.models import User, OAuth
+from project.users.models import User
 from project.helpers import not_loggedin_required, current_user_required
+from project.versions import conditional
 
-from flask_login import login_required, login_user, logout_user, current_user
-from flask_dance.consumer import oauth_authorized
-from sqlalchemy.orm.exc import NoResultFound
+from flask_login import login_required, login_user, logout_user
 from sqlalchemy.exc import IntegrityError
 
 users_blueprint = Blueprint('users', __name__, template_folder='templates')
 
 
-# OAuth
-
-@oauth_authorized.connect_via(twitter_blueprint)
-def twitter_logged_in(twitter_blueprint, token):
-    if not token:
-        flash("Failed to log in with Twitter.", category="error")
-        return False
-
-    resp = twitter_blueprint.session.get("account/settings.json")
-
-    if not resp.ok:
-        msg = "Failed to fetch user info from Twitter."
-        flash(msg, category="error")
-        return False
-
-    twitter_info = resp.json()
-    twitter_username = twitter_info['screen_name']
-
-    # Find this OAuth token in the database, or create it
-    query = OAuth.query.filter_by(
-        provider=twitter_blueprint.name,
-        twitter_username=twitter_username,
-    )
-    try:
-        # Existing OAuth token in database
-        oauth = query.one()
-    except NoResultFound:
-        # Create new OAuth token
-        oauth = OAuth(
-            provider=twitter_blueprint.name,
-            twitter_username=twitter_username,
-            token=token,
-        )
-
-    # If the token is associated with a user (?), log the user in
-    if oauth.user:
-        login_user(oauth.user)
-        flash("Successfully signed in with Twitter.")
-    else:
-        """
-        # Successful OAuth authentication without adding OAuth to existing non-OAuth accounts
-        # Create a new local user account for this user
-        user = User(
-            first_name=twitter_username,
-            # Less secure, but no username is generated, so on its own password cannot be used to log in
-            password='password' 
-        )
-        # Associate the new local user account with the OAuth token
-        oauth.user = user
-        # Save and commit our database models
-        db.session.add_all([user, oauth])
-        db.session.commit()
-        # Log in the new local user account
-        login_user(user)
-        flash("Successfully signed in with Twitter.")
-        """
-
-        # If user account already exists but there is no associated OAuth token
-        if current_user.is_authenticated:
-            oauth.user = current_user
-            db.session.add(oauth)
-            db.session.commit()
-            flash("Successfully linked Twitter account.")
-        else:
-            # Create a new local user account for this user
-            user = User(
-                first_name=twitter_username,
-                # Less secure, but no username is generated, so on its own password cannot be used to log in
-                password='password'
-            )
-            # Associate the new local user account with the OAuth token
-            oauth.user = user
-            # Save and commit our database models
-            db.session.add_all([user, oauth])
-            db.session.commit()
-            # Log in the new local user account
-            login_user(user)
-            flash("Successfully signed in with Twitter.")
-
-    # Disable Flask-Dance's default behavior for saving the OAuth token
-    return False
-
-
 # Authentication
 
 
@@ -147,6 +63,7 @@ def logout():
 
 
 @users_blueprint.route('/', methods=["GET", "POST"])
+@conditional('users')
 def users():
     return render_template('users/index.html', users=User.query.all())
 
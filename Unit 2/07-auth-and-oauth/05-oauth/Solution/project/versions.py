@@ -0,0 +1,203 @@
+import hashlib
+import json
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.interfaces import ONETOMANY
+from werkzeug.http import is_resource_modified
+
+from project import db
+
+# Well under the 999 variables older SQLite builds allow per statement
+IN_CHUNK_SIZE = 500
+
+
+class TableVersion(db.Model):
+
+    __tablename__ = "table_versions"
+
+    # One row per table, bumped in the same transaction as every write to it
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+
+def bump_versions(connection, names):
+    # Call this directly for writes that bypass the ORM session
+    now = datetime.utcnow()
+    for name in sorted(set(names)):
+        connection.execute(_upsert(connection.dialect.name, name, now))
+
+
+def _upsert(dialect, name, now):
+    # One statement inserts the first version or increments it, so two
+    # transactions writing to a table for the first time cannot both insert
+    table = TableVersion.__table__
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).values(name=name, version=1, updated_at=now).on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={'version': table.c.version + 1, 'updated_at': now})
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        return insert(table).values(name=name, version=1, updated_at=now).on_duplicate_key_update(
+            version=table.c.version + 1, updated_at=now)
+    # SQLite 3.24 and later, SQLAlchemy 1.3 has no construct for it
+    return text("INSERT INTO table_versions (name, version, updated_at) "
+                "VALUES (:name, 1, :now) ON CONFLICT (name) "
+                "DO UPDATE SET version = version + 1, updated_at = :now").bindparams(
+                    name=name, now=now)
+
+
+@event.listens_for(db.session, 'before_flush')
+def bump_row_versions(session, flush_context, instances):
+    # Rows with a version column, e.g. messages and tags, count their updates
+    # so caches can key on (id, version). Adding or removing a many-to-many
+    # link counts as an update of the rows on both sides.
+    bumped = set()
+    for obj in session.deleted:
+        # Deleting a row nulls the foreign keys of the rows referencing it,
+        # e.g. the messages of a deleted user, which counts as their update
+        for rel in _referencing(obj):
+            with session.no_autoflush:
+                linked = list(getattr(obj, rel.key))
+            bumped.update(other for other in linked if hasattr(other, 'version'))
+    for obj in session.new | session.dirty | session.deleted:
+        if not hasattr(obj, 'version'):
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and session.is_modified(obj):
+            bumped.add(obj)
+        for rel in state.mapper.relationships:
+            if rel.secondary is None:
+                continue
+            if obj in session.deleted:
+                linked = getattr(obj, rel.key)
+            else:
+                history = state.attrs[rel.key].history
+                linked = list(history.added or ()) + list(history.deleted or ())
+            bumped.update(other for other in linked if hasattr(other, 'version'))
+    for obj in bumped:
+        if obj not in session.new and obj not in session.deleted:
+            obj.version = (obj.version or 0) + 1
+
+
+def _referencing(obj):
+    # One-to-many relationships whose rows are updated or deleted with obj
+    return [rel for rel in inspect(obj).mapper.relationships
+            if rel.direction is ONETOMANY and rel.secondary is None]
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_flushed_versions(session, flush_context):
+    # The session still holds the pre-flush new/dirty/deleted objects here
+    names = {inspect(obj).mapper.local_table.name
+             for obj in session.new | session.dirty | session.deleted
+             if not isinstance(obj, TableVersion)}
+    names.update(rel.mapper.local_table.name
+                 for obj in session.deleted for rel in _referencing(obj))
+    if names:
+        bump_versions(session.connection(), names)
+        g.pop('table_versions', None)
+
+
+def init_versions(app):
+    """Compute the build id mixed into every ETag and let templates key
+    cached fragments on table versions
+
+    The same tables render differently after a deploy, so the id hashes
+    the asset manifest, which changes with the static files, and
+    APP_VERSION, which should change with the code and templates.
+    """
+    stamp = json.dumps([app.extensions.get('assets', {}), app.config['APP_VERSION']],
+                       sort_keys=True)
+    app.extensions['build_id'] = hashlib.md5(stamp.encode()).hexdigest()[:8]
+    app.add_template_global(table_version)
+    app.add_template_global(linked_versions)
+
+
+def table_versions():
+    # Version and update time of every tracked table, read once per request
+    if 'table_versions' not in g:
+        g.table_versions = {
+            name: (version, updated_at) for name, version, updated_at in
+            db.session.query(TableVersion.name, TableVersion.version, TableVersion.updated_at)}
+    return g.table_versions
+
+
+def table_version(name):
+    return table_versions().get(name, (0, None))[0]
+
+
+def linked_versions(rows, key):
+    """Returns the sum of the versions of the rows linked to each of rows
+    through the many-to-many relationship key, by id
+
+    Versions only grow and linking or unlinking bumps both sides, so the
+    sum changes whenever one of the linked rows changes, e.g. renaming one
+    of the tags of a message but not creating or renaming another tag.
+
+    Pass the query a page renders, e.g. Message.query, so its ids are
+    selected in a subquery instead of bound one by one. Lists of rows are
+    bound in chunks of IN_CHUNK_SIZE ids.
+    """
+    if isinstance(rows, Query):
+        model = rows.column_descriptions[0]['entity']
+        ids = [rows.with_entities(inspect(model).primary_key[0]).statement]
+    else:
+        rows = list(rows)
+        if not rows:
+            return {}
+        model = type(rows[0])
+        ids = [[row.id for row in rows[i:i + IN_CHUNK_SIZE]]
+               for i in range(0, len(rows), IN_CHUNK_SIZE)]
+    rel = inspect(model).relationships[key]
+    target = rel.mapper.local_table
+    column = rel.synchronize_pairs[0][1]
+    versions = {}
+    for chunk in ids:
+        query = (select([column, func.sum(target.c.version)])
+                 .select_from(rel.secondary.join(target, rel.secondaryjoin))
+                 .where(column.in_(chunk))
+                 .group_by(column))
+        versions.update(db.session.execute(query).fetchall())
+    return versions
+
+
+def version_stamp(names):
+    # Returns the ETag and Last-Modified date for a page built from the tables
+    versions = table_versions()
+    last_modified = None
+    for name in names:
+        updated_at = versions.get(name, (0, None))[1]
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    etag = "-".join([current_app.extensions['build_id']] +
+                    [f"{name}.{table_version(name)}" for name in sorted(names)])
+    return etag, last_modified
+
+
+def conditional(*names):
+    # Answer GET requests with 304 Not Modified, before running the view,
+    # while none of the tables the page is built from have changed
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Pages with pending flash messages must always be rendered
+            if request.method != "GET" or '_flashes' in session:
+                return fn(*args, **kwargs)
+            etag, last_modified = version_stamp(names)
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(fn(*args, **kwargs))
+            else:
+                response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Let browsers keep the page but revalidate it on every view
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
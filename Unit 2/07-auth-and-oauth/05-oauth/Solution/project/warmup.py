@@ -0,0 +1,16 @@
+from sqlalchemy.orm import configure_mappers
+
+from project import bcrypt
+from project.templating import warm_templates
+
+
+def warm_app(app):
+    # Do a worker's expensive one-off setup up front, e.g. in the gunicorn
+    # master with preload_app so every forked worker shares the result
+    with app.app_context():
+        # Build the SQLAlchemy mappers and relationships of every model
+        configure_mappers()
+        # Compile the templates of the app and its blueprints
+        warm_templates(app)
+        # Load the bcrypt backend with a single hash
+        bcrypt.generate_password_hash('warmup')
@@ -1,9 +1,13 @@
-from project import db
+from project import create_app, db
 
 from project.users.models import User
 from project.messages.models import Message
 from project.tags.models import Tag
 
+# Create the app and make it the current app for the database session
+app = create_app()
+app.app_context().push()
+
 # Delete existing data, if any
 db.drop_all()
 
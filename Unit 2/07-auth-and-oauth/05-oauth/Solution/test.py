@@ -1,10 +1,42 @@
+import os
+import shutil
+import tempfile
+import json
+import re
 import unittest
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
 from flask_testing import TestCase
-from project import app, db, bcrypt
+from project import create_app, db, bcrypt
+from project.templating import FragmentCache, init_template_cache, warm_templates
+from project.warmup import warm_app
+from project.assets import build_assets
+from project.compression import CompressionMiddleware
+from project.export import checkpoint, export_messages
+from project.importer import import_messages
+from project.search import search_messages
+from project.tokens import InvalidToken, decode, encode
+from project.ratelimit import MemoryStore, SharedCounters, TokenBuckets
+from project import tagquery
 from project.users.models import User
-from project.messages.models import Message
+from project.messages.models import Message, MessageTags
+from project.tags.models import Tag
+from project.oauth import OAuth
 from flask import request
 from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from flask_migrate import Migrate, upgrade
+
+app = create_app({
+    "WTF_CSRF_ENABLED": False,
+    "SQLALCHEMY_ECHO": False,
+    "SQLALCHEMY_DATABASE_URI": 'sqlite:///testing.db',
+    "RATELIMIT_ENABLED": False,
+})
 
 class TestUser(TestCase):
 
@@ -14,9 +46,6 @@ class TestUser(TestCase):
             password=password), follow_redirects=follow_redirects)
 
     def create_app(self):
-        app.config["WTF_CSRF_ENABLED"] = False
-        app.config["SQLALCHEMY_ECHO"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///testing.db'
         return app
 
     def setUp(self):
@@ -181,6 +210,788 @@ class TestUser(TestCase):
             self._login_user('secret','secret')
             response = self.client.post('/users/1/messages/1?_method=DELETE', follow_redirects=True)
             self.assertIn(b'Not Authorized', response.data)
+    def test_warm_templates_writes_bytecode_cache(self):
+        """Ensure warming compiles every template into the bytecode cache"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            app.config['TEMPLATE_CACHE_DIR'] = cache_dir
+            init_template_cache(app)
+            app.jinja_env.cache.clear()
+            names = warm_templates(app)
+            self.assertIn('base.html', names)
+            self.assertIn('messages/messages_index.html', names)
+            self.assertIn('users/login.html', names)
+            self.assertEqual(len(os.listdir(cache_dir)), len(names))
+            app.config['TEMPLATE_CACHE_DIR'] = None
+            init_template_cache(app)
+    def test_create_app_without_twitter(self):
+        """Ensure the factory can build an app without the OAuth blueprint"""
+        plain_app = create_app({"TWITTER_OAUTH": False})
+        self.assertNotIn('twitter', plain_app.blueprints)
+        self.assertIn('users', plain_app.blueprints)
+        response = plain_app.test_client().get('/users/login')
+        self.assertIn(b'Login', response.data)
+        self.assertNotIn(b'Twitter Login', response.data)
+    def test_warm_app_compiles_templates(self):
+        """Ensure the prefork warm-up leaves every template compiled"""
+        app.jinja_env.cache.clear()
+        warm_app(app)
+        cached = [name for _, name in app.jinja_env.cache.keys()]
+        for name in app.jinja_env.list_templates():
+            self.assertIn(name, cached)
+    def test_conditional_get(self):
+        """Ensure list pages answer 304 until one of their tables changes"""
+        response = self.client.get('/users/')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        response = self.client.get('/users/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        db.session.add(User("Tim", "Garcia", "tigarcia", "secret"))
+        db.session.commit()
+        response = self.client.get('/users/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Tim', response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_conditional_get_tracks_message_tags(self):
+        """Ensure tagging a message changes the ETag of the message pages"""
+        message = Message("Hello World", 1)
+        db.session.add(message)
+        db.session.commit()
+        etag = self.client.get('/messages').headers['ETag']
+        message.tags.append(Tag("Greeting"))
+        db.session.commit()
+        response = self.client.get('/messages', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Greeting', response.data)
+
+    def test_conditional_get_changes_with_deploy(self):
+        """Ensure a new app version changes the ETag of unchanged tables"""
+        etag = self.client.get('/users/').headers['ETag']
+        deployed = create_app({"SQLALCHEMY_DATABASE_URI": 'sqlite:///testing.db',
+                               "APP_VERSION": "2"})
+        response = deployed.test_client().get('/users/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_deleting_user_bumps_messages(self):
+        """Ensure deleting a user counts as an update of their messages"""
+        user = User("Tim", "Garcia", "tigarcia", "secret")
+        message = Message("Hello World", None)
+        user.messages.append(message)
+        db.session.add(user)
+        db.session.commit()
+        with app.test_request_context():
+            from project.versions import table_version
+            before = table_version('messages')
+        db.session.delete(user)
+        db.session.commit()
+        self.assertIsNone(message.user_id)
+        self.assertEqual(message.version, 2)
+        with app.test_request_context():
+            self.assertEqual(table_version('messages'), before + 1)
+
+    def test_linked_versions(self):
+        """Ensure queries and chunked lists of rows sum the same versions"""
+        from project import versions
+        greeting, farewell = Tag("Greeting"), Tag("Farewell")
+        messages = [Message("Message %d" % i, 1) for i in range(5)]
+        for i, message in enumerate(messages):
+            message.tags = [greeting, farewell][:i % 3]
+        db.session.add_all(messages)
+        db.session.commit()
+        farewell.name = "Goodbye"
+        db.session.commit()
+        # Greeting is at version 1, the renamed Farewell at version 2
+        expected = {message.id: [0, 1, 3][i % 3] for i, message in enumerate(messages) if i % 3}
+        self.assertEqual(versions.linked_versions(Message.query, 'tags'), expected)
+        self.addCleanup(setattr, versions, 'IN_CHUNK_SIZE', versions.IN_CHUNK_SIZE)
+        versions.IN_CHUNK_SIZE = 2
+        self.assertEqual(versions.linked_versions(Message.query.all(), 'tags'), expected)
+        self.assertEqual(versions.linked_versions([], 'tags'), {})
+
+    def test_fragment_cache(self):
+        """Ensure tag lists are served from cache until a tag changes"""
+        cache = app.jinja_env.fragment_cache
+        cache.clear()
+        message = Message("Hello World", 1)
+        tag = Tag("Greeting")
+        message.tags.append(tag)
+        db.session.add(message)
+        db.session.commit()
+        self.client.get('/messages')
+        self.client.get('/messages')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        tag.name = "Welcome"
+        db.session.commit()
+        response = self.client.get('/messages')
+        self.assertIn(b'Welcome', response.data)
+        self.assertEqual(cache.misses, 2)
+        # A tag of no message on the page leaves the fragment cached
+        db.session.add(Tag("Unused"))
+        db.session.commit()
+        self.client.get('/messages')
+        self.assertEqual(cache.misses, 2)
+        # The tags page lists the message under its tag until it is edited
+        self.assertIn(b'Hello World', self.client.get('/tags/').data)
+        message.content = "Hello Again"
+        db.session.commit()
+        self.assertIn(b'Hello Again', self.client.get('/tags/').data)
+
+    def test_fragment_cache_evicts_least_recently_used(self):
+        """Ensure the fragment cache stays within its size bound"""
+        cache = FragmentCache(10)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.get('a')
+        cache.set('c', 'xxxx')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'xxxx')
+        self.assertEqual(cache.stats()['size'], 8)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_fingerprinted_assets(self):
+        """Ensure built static files are linked and served as immutable"""
+        # Build into a copy, so builds in project/static are left alone
+        static_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_folder)
+        shutil.copy(os.path.join(app.static_folder, 'style.css'), static_folder)
+        manifest = build_assets(static_folder)
+        assets_app = create_app(dict(app.config, STATIC_FOLDER=static_folder))
+        client = assets_app.test_client()
+        filename = manifest['style.css']
+        response = client.get('/users/login')
+        self.assertIn(('/static/' + filename).encode(), response.data)
+
+        response = client.get('/static/' + filename, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        # .br variants are only built when brotli is installed
+        self.assertEqual(response.headers['Content-Encoding'], 'br' if brotli else 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        response = client.get('/static/' + filename, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response = client.get('/static/' + filename)
+        self.assertNotIn('Content-Encoding', response.headers)
+        with open(os.path.join(app.static_folder, 'style.css'), 'rb') as f:
+            self.assertEqual(response.data, f.read())
+
+        assets_app.config['ASSETS_ACCEL_REDIRECT'] = '/protected/'
+        response = assets_app.test_client().get('/static/' + filename)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected/' + filename)
+        self.assertEqual(response.data, b'')
+        # Missing files and paths leaving the static folder are not
+        # handed to the web server
+        for path in ['dist/missing.css', 'dist/..%2f..%2f__init__.py']:
+            response = assets_app.test_client().get('/static/' + path)
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_superseded_assets_are_kept(self):
+        """Ensure a build keeps the files of the previous one for a while"""
+        static_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_folder)
+        with open(os.path.join(static_folder, 'style.css'), 'w') as f:
+            f.write('body { color: red; }')
+        old = build_assets(static_folder, keep=60, now=1000)['style.css']
+        with open(os.path.join(static_folder, 'style.css'), 'w') as f:
+            f.write('body { color: blue; }')
+        new = build_assets(static_folder, keep=60, now=1030)['style.css']
+        self.assertNotEqual(old, new)
+        self.assertTrue(os.path.exists(os.path.join(static_folder, old)))
+        self.assertTrue(os.path.exists(os.path.join(static_folder, old + '.gz')))
+        # A minute after it was replaced the old build is removed
+        build_assets(static_folder, keep=60, now=1090)
+        self.assertFalse(os.path.exists(os.path.join(static_folder, old)))
+        self.assertFalse(os.path.exists(os.path.join(static_folder, old + '.gz')))
+        self.assertTrue(os.path.exists(os.path.join(static_folder, new)))
+
+    def test_compressed_responses(self):
+        """Ensure large pages are compressed and keep answering 304"""
+        db.session.add_all([User("User", str(i), "user%d" % i, "secret") for i in range(10)])
+        db.session.commit()
+        plain = self.client.get('/users/')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        response = self.client.get('/users/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(zlib.decompress(response.data, 31), plain.data)
+        self.assertLess(len(response.data), len(plain.data) / 2)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get('/users/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # Small responses are not worth compressing
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    @unittest.skipUnless(brotli, "brotli is not installed")
+    def test_brotli_responses(self):
+        """Ensure browsers accepting brotli get it rather than gzip"""
+        db.session.add_all([User("User", str(i), "user%d" % i, "secret") for i in range(10)])
+        db.session.commit()
+        plain = self.client.get('/users/')
+        response = self.client.get('/users/', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data) / 2)
+        etag = response.headers['ETag']
+        response = self.client.get('/users/', headers={'Accept-Encoding': 'br', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_compression_streams(self):
+        """Ensure every chunk is compressed and sent as soon as it is made"""
+        produced = []
+
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for i in range(3):
+                produced.append(i)
+                yield b'line %d ' % i * 100
+
+        middleware = CompressionMiddleware(streaming_app, min_size=100)
+        body = middleware({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                          lambda status, headers, exc_info=None: None)
+        decompressor = zlib.decompressobj(31)
+        chunks = iter(body)
+        self.assertEqual(decompressor.decompress(next(chunks)), b'line 0 ' * 100)
+        self.assertEqual(produced, [0])
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks)
+        self.assertEqual(rest, b'line 1 ' * 100 + b'line 2 ' * 100)
+        body.close()
+
+    def test_api(self):
+        """Ensure the JSON API serializes users, messages and their tags"""
+        message = Message("Hello World", 1)
+        message.tags.append(Tag("Greeting"))
+        db.session.add(message)
+        db.session.commit()
+        response = self.client.get('/api/v1/users')
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_json(), [
+            {'id': 1, 'first_name': 'Elie', 'last_name': 'Schoppik'}])
+        response = self.client.get('/api/v1/users/1/messages')
+        self.assertEqual(response.get_json(), [{
+            'id': 1, 'content': 'Hello World', 'user_id': 1, 'version': 1,
+            'tags': [{'id': 1, 'name': 'Greeting', 'version': 1}]}])
+        response = self.client.get('/api/v1/messages/1?fields=content,tags')
+        self.assertEqual(response.get_json(), {
+            'content': 'Hello World', 'tags': [{'id': 1, 'name': 'Greeting', 'version': 1}]})
+        response = self.client.get('/api/v1/tags?fields=name')
+        self.assertEqual(response.get_json(), [{'name': 'Greeting'}])
+        # Reordered and repeated selections share one generated serializer
+        from project.api.views import tag_schema
+        tag_schema._serializers.clear()
+        for fields in ['name,id', 'id,name', 'id,name,id']:
+            response = self.client.get('/api/v1/tags?fields=' + fields)
+            self.assertEqual(response.get_json(), [{'id': 1, 'name': 'Greeting'}])
+        self.assertEqual(list(tag_schema._serializers), [('id', 'name')])
+
+        for field in ['password', 'username']:
+            response = self.client.get('/api/v1/users/1?fields=' + field)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json(), {'error': 'Unknown fields: ' + field})
+        response = self.client.get('/api/v1/messages/2')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.get_json())
+
+    def test_export_messages(self):
+        """Ensure messages stream as NDJSON with their author and tags"""
+        greeting, quote = Tag("Greeting"), Tag("Quote")
+        for i in range(5):
+            message = Message("Message %d" % i, 1 if i % 2 else None)
+            message.tags.extend([greeting, quote][:i % 3])
+            db.session.add(message)
+        db.session.commit()
+        lines = [json.loads(line) for line in b''.join(export_messages(after=1)).splitlines()]
+        self.assertEqual([line['id'] for line in lines], [2, 3, 4, 5])
+        self.assertEqual(lines[0], {
+            'id': 2, 'content': 'Message 1',
+            'user': {'id': 1, 'username': 'eschoppik', 'first_name': 'Elie', 'last_name': 'Schoppik'},
+            'tags': [{'id': 1, 'name': 'Greeting'}]})
+        self.assertEqual(lines[1]['user'], None)
+        # The unit of work inserts the links of one message in no set order
+        self.assertEqual(sorted(tag['name'] for tag in lines[1]['tags']), ['Greeting', 'Quote'])
+        # Small batches give the same lines in several chunks
+        chunks = list(export_messages(batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual([json.loads(line) for line in b''.join(chunks).splitlines()[1:]], lines)
+
+    def test_export_messages_api(self):
+        """Ensure the API exports only the requesting user's messages"""
+        db.session.add_all([Message("Mine", 1), Message("Nobody's", None), Message("Mine too", 1)])
+        db.session.commit()
+        response = self.client.get('/api/v1/export/messages')
+        self.assertEqual(response.status_code, 401)
+        self._login_user('eschoppik', 'secret')
+        response = self.client.get('/api/v1/export/messages?after=1')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([line['content'] for line in lines], ['Mine too'])
+
+    def test_export_checkpoint(self):
+        """Ensure an interrupted export resumes after its last full line"""
+        path = os.path.join(tempfile.mkdtemp(), 'messages.ndjson')
+        self.assertEqual(checkpoint(path), 0)
+        with open(path, 'wb') as f:
+            f.write(b'{"id":1}\n{"id":2}\n{"id":')
+        self.assertEqual(checkpoint(path), 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'{"id":1}\n{"id":2}\n')
+
+    def test_import_messages(self):
+        """Ensure imported messages are linked to existing and new tags"""
+        db.session.add(Tag("Greeting"))
+        db.session.commit()
+        etag = self.client.get('/messages').headers['ETag']
+        records = [
+            {'user': 'eschoppik', 'content': 'Hello', 'tags': ['Greeting', 'New', 'Greeting']},
+            {'user': 1, 'content': 'Bye', 'tags': ['New']},
+            {'user': 'nobody', 'content': 'Lost'},
+            {'user': 1, 'content': ''},
+            {'user': 1, 'content': 'No tags'},
+        ]
+        body = '\n'.join(json.dumps(record) for record in records) + '\n{not json\n'
+        self._login_user('eschoppik', 'secret')
+        app.config['IMPORT_BATCH_SIZE'] = 2
+        try:
+            report = self.client.post('/api/v1/import/messages', data=body,
+                                      content_type='application/x-ndjson').get_json()
+        finally:
+            app.config['IMPORT_BATCH_SIZE'] = 5000
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual([rejected['line'] for rejected in report['rejected']], [3, 4, 6])
+        messages = Message.query.order_by(Message.id).all()
+        self.assertEqual([m.content for m in messages], ['Hello', 'Bye', 'No tags'])
+        self.assertEqual([t.name for t in messages[0].tags], ['Greeting', 'New'])
+        self.assertEqual(messages[1].tags, [messages[0].tags[1]])
+        self.assertEqual(Tag.query.count(), 2)
+        # Pages built from messages are no longer answered with 304
+        response = self.client.get('/messages', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_import_messages_as_another_user(self):
+        """Ensure users can only import messages as themselves"""
+        db.session.add(User("Tim", "Garcia", "tigarcia", "secret"))
+        db.session.commit()
+        records = [
+            {'user': 'eschoppik', 'content': 'Mine'},
+            {'user': 'tigarcia', 'content': 'Not mine'},
+            {'user': 1, 'content': 'Mine too'},
+            {'user': 2, 'content': 'Not mine either'},
+            {'content': 'Mine by default', 'tags': ['Greeting']},
+        ]
+        self._login_user('eschoppik', 'secret')
+        body = '\n'.join(json.dumps(record) for record in records)
+        report = self.client.post('/api/v1/import/messages', data=body,
+                                  content_type='application/x-ndjson').get_json()
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual([rejected['line'] for rejected in report['rejected']], [2, 4])
+        self.assertEqual(report['rejected_count'], 2)
+        self.assertEqual({m.user_id for m in Message.query}, {1})
+        self.assertEqual([m.content for m in Message.query.order_by(Message.id)],
+                         ['Mine', 'Mine too', 'Mine by default'])
+        self.assertEqual([t.name for t in Message.query.get(3).tags], ['Greeting'])
+        # A cross-site form can post text/plain, which is refused
+        response = self.client.post('/api/v1/import/messages', data='{"content":"spam","pad":"=x"}',
+                                    content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(Message.query.filter_by(content='spam').count(), 0)
+
+    def test_import_report_is_bounded(self):
+        """Ensure a report lists a bounded number of rejected records"""
+        from project.importer import MAX_REJECTED
+        report = import_messages(['{not json'] * (MAX_REJECTED + 5))
+        self.assertEqual(len(report.rejected), MAX_REJECTED)
+        self.assertEqual(report.as_dict()['rejected_count'], MAX_REJECTED + 5)
+
+    def test_batch_messages(self):
+        """Ensure batched operations are applied together or not at all"""
+        other = User("Tim", "Garcia", "tigarcia", "secret")
+        db.session.add_all([other, Tag("One"), Tag("Two")])
+        db.session.add_all([Message("First", 1), Message("Second", 1), Message("Theirs", 2)])
+        db.session.commit()
+        self._login_user('eschoppik', 'secret')
+        url = '/api/v1/users/1/messages/batch'
+        invalid = [
+            {'op': 'update', 'id': 1, 'content': 'Changed'},
+            {'op': 'update', 'id': 3, 'content': 'Not mine'},
+            {'op': 'create', 'content': 'x' * 101},
+            {'op': 'delete', 'id': 2},
+            {'op': 'update', 'id': 2, 'content': 'Deleted'},
+            {'op': 'create', 'content': 'Tagged', 'tags': [1, 99]},
+            {'op': 'move'},
+        ]
+        response = self.client.post(url, json=invalid)
+        self.assertEqual(response.status_code, 400)
+        errors = [result.get('error') for result in response.get_json()['results']]
+        self.assertEqual([error is None for error in errors], [True, False, False, True, False, False, False])
+        self.assertEqual(Message.query.get(1).content, 'First')
+        self.assertEqual(Message.query.count(), 3)
+
+        operations = [
+            {'op': 'create', 'content': 'Third', 'tags': [1, 2, 1]},
+            {'op': 'update', 'id': 1, 'content': 'Changed', 'tags': [2]},
+            {'op': 'update', 'id': 2, 'tags': []},
+            {'op': 'delete', 'id': 2},
+        ]
+        response = self.client.post(url, json=operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['results'], [
+            {'index': 0, 'op': 'create', 'id': 4, 'version': 1},
+            {'index': 1, 'op': 'update', 'id': 1, 'version': 2},
+            {'index': 2, 'op': 'update', 'id': 2, 'version': 1},
+            {'index': 3, 'op': 'delete', 'id': 2},
+        ])
+        self.assertEqual(sorted(t.name for t in Message.query.get(4).tags), ['One', 'Two'])
+        self.assertEqual([t.name for t in Message.query.get(1).tags], ['Two'])
+        self.assertIsNone(Message.query.get(2))
+
+        self.assertEqual(self.client.post('/api/v1/users/2/messages/batch',
+                                          json=operations).status_code, 403)
+        self.assertEqual(self.client.post(url, data='not json',
+                                          content_type='application/json').status_code, 400)
+        # A cross-site form can post text/plain, which is refused
+        response = self.client.post(url, data='[{"op":"delete","id":1,"pad":"=x"}]',
+                                    content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+        self.assertIsNotNone(Message.query.get(1))
+
+    def test_api_tokens(self):
+        """Ensure API requests authorize with access tokens and no queries"""
+        response = self.client.post('/api/v1/tokens', data=json.dumps(
+            {'username': 'eschoppik', 'password': 'wrong'}))
+        self.assertEqual(response.status_code, 401)
+        tokens = self.client.post('/api/v1/tokens', data=json.dumps(
+            {'username': 'eschoppik', 'password': 'secret'})).get_json()
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 401)
+
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get('/api/v1/me', headers={
+                'Authorization': 'Bearer ' + tokens['access_token']})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(response.get_json(), {'id': 1, 'name': 'Elie Schoppik'})
+        self.assertEqual(statements, [])
+
+        # Refresh tokens are not access tokens, and are used only once
+        response = self.client.get('/api/v1/me', headers={
+            'Authorization': 'Bearer ' + tokens['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        refresh = json.dumps({'refresh_token': tokens['refresh_token']})
+        renewed = self.client.post('/api/v1/tokens/refresh', data=refresh).get_json()
+        self.assertIn('access_token', renewed)
+        self.assertEqual(self.client.post('/api/v1/tokens/refresh', data=refresh).status_code, 401)
+        revoke = json.dumps({'refresh_token': renewed['refresh_token']})
+        self.assertEqual(self.client.post('/api/v1/tokens/revoke', data=revoke).status_code, 200)
+        self.assertEqual(self.client.post('/api/v1/tokens/refresh', data=revoke).status_code, 401)
+
+    def test_api_session_requires_csrf_token(self):
+        """Ensure a session cookie alone cannot change data through the API"""
+        db.session.add(Message("Hello", 1))
+        db.session.commit()
+        protected = create_app(dict(app.config, WTF_CSRF_ENABLED=True))
+        client = protected.test_client()
+        page = client.get('/users/login').data.decode()
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+        client.post('/users/login', data=dict(username='eschoppik', password='secret',
+                                               csrf_token=token))
+        # Reading with the session needs no token
+        self.assertEqual(client.get('/api/v1/me').status_code, 200)
+        url = '/api/v1/users/1/messages/batch'
+        body = json.dumps([{'op': 'delete', 'id': 1}])
+        response = client.post(url, data=body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Message.query.count(), 1)
+        response = client.post(url, data=body, content_type='application/json',
+                               headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_token_verification(self):
+        """Ensure tampered, expired and foreign tokens are rejected"""
+        claims = {'type': 'access', 'sub': 1, 'name': 'Elie Schoppik', 'exp': 2 ** 40}
+        token = encode(claims, 'key')
+        self.assertEqual(decode(token, 'key', 'access'), claims)
+        header, payload, signature = token.split('.')
+        forged = encode(dict(claims, sub=2), 'key').split('.')[1]
+        expired = encode(dict(claims, exp=1), 'key')
+        for bad in ['.'.join([header, forged, signature]), expired, 'not a token', 'a.b.c',
+                    encode(claims, 'other key'), 'é.é.é']:
+            with self.assertRaises(InvalidToken):
+                decode(bad, 'key', 'access')
+        with self.assertRaises(InvalidToken):
+            decode(token, 'key', 'refresh')
+
+    def test_rate_limited_login(self):
+        """Ensure logins over the limit are refused before hashing passwords"""
+        limits = app.config['RATELIMITS']
+        app.config.update(RATELIMIT_ENABLED=True, RATELIMITS={'users.login': '3/minute'})
+        app.extensions['ratelimit'] = TokenBuckets()
+        try:
+            responses = [self._login_user('eschoppik', 'wrong') for i in range(4)]
+            # Only unsafe methods count
+            self.assertEqual(self.client.get('/users/login').status_code, 200)
+        finally:
+            app.config.update(RATELIMIT_ENABLED=False, RATELIMITS=limits)
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertEqual([r.headers['X-RateLimit-Remaining'] for r in responses], ['2', '1', '0', '0'])
+        self.assertIn('Retry-After', responses[3].headers)
+
+    def test_rate_limit_behind_proxy(self):
+        """Ensure clients behind a trusted proxy are limited separately"""
+        proxied = create_app(dict(app.config, RATELIMIT_ENABLED=True, PROXY_COUNT=1,
+                                  RATELIMITS={'users.login': '1/minute'}))
+        client = proxied.test_client()
+
+        def login(address):
+            return client.post('/users/login', data=dict(username='eschoppik', password='wrong'),
+                               headers={'X-Forwarded-For': address}).status_code
+        self.assertEqual([login('10.0.0.1'), login('10.0.0.2'), login('10.0.0.1')], [200, 200, 429])
+        # Addresses a client adds before the proxy's are not trusted
+        self.assertEqual(login('10.0.0.3, 10.0.0.2'), 429)
+
+    def test_rate_limit_backends(self):
+        """Ensure token buckets refill and shared counters reset per window"""
+        buckets = TokenBuckets()
+        hits = [buckets.hit('client', 2, 60, now=0)[0] for i in range(3)]
+        self.assertEqual(hits, [True, True, False])
+        self.assertEqual(buckets.hit('client', 2, 60, now=15)[0], False)
+        self.assertEqual(buckets.hit('client', 2, 60, now=30), (True, 0, 0))
+        self.assertEqual(buckets.hit('other', 2, 60, now=30)[0], True)
+        # Beyond max_keys the least recently seen client is dropped
+        buckets = TokenBuckets(max_keys=2)
+        for key in ['a', 'b', 'a', 'c']:
+            buckets.hit(key, 1, 60, now=0)
+        self.assertEqual(list(buckets._buckets), ['a', 'c'])
+
+        # Two processes sharing one store share the limit
+        store = MemoryStore()
+        first, second = SharedCounters(store), SharedCounters(store)
+        hits = [counters.hit('client', 3, 60, now=120)[0] for counters in [first, second] * 2]
+        self.assertEqual(hits, [True, True, True, False])
+        self.assertEqual(first.hit('client', 3, 60, now=130)[2], 50)
+        self.assertEqual(second.hit('client', 3, 60, now=180), (True, 2, 0))
+
+    def test_search_messages(self):
+        """Ensure searches rank matching messages and follow every write"""
+        db.session.add_all([
+            Message("Learning Flask", 1),
+            Message("Flask routing and Flask templates", 1),
+            Message("Nothing to see here", 1),
+            Message("Testing flask apps", 1),
+        ])
+        db.session.commit()
+
+        def search(query, **args):
+            response = self.client.get('/api/v1/search/messages', query_string=dict(args, q=query))
+            return response.get_json()
+
+        data = search('flask')
+        self.assertEqual(data['results'][0]['content'], "Flask routing and Flask templates")
+        self.assertEqual(sorted(m['id'] for m in data['results']), [1, 2, 4])
+        self.assertFalse(data['has_more'])
+        # Stemmed words must all match, whatever the query syntax
+        self.assertEqual([m['id'] for m in search('test FLASK')['results']], [4])
+        self.assertEqual(search('"AND (flask')['results'][0]['id'], 2)
+        self.assertEqual(search('')['results'], [])
+
+        pages = [search('flask', page=page, per_page=2, fields='id') for page in (1, 2)]
+        self.assertEqual([page['has_more'] for page in pages], [True, False])
+        self.assertEqual(pages[0]['results'] + pages[1]['results'], [{'id': id} for id in [2, 1, 4]])
+        response = self.client.get('/api/v1/search/messages?q=flask&per_page=1000')
+        self.assertEqual(response.status_code, 400)
+
+        message = Message.query.get(3)
+        message.content = "Flask at last"
+        db.session.delete(Message.query.get(1))
+        db.session.commit()
+        self.assertEqual(sorted(m['id'] for m in search('flask')['results']), [2, 3, 4])
+        self.assertEqual(search('nothing')['results'], [])
+
+    def test_tag_query(self):
+        """Ensure tag expressions give the same ids from SQL and from bitmaps"""
+        japan, country, quote, city = Tag("Japan"), Tag("Country"), Tag("Quote"), Tag("New York")
+        tagged = [[japan, country], [japan, country, quote], [japan], [country, city], []]
+        for i, tags in enumerate(tagged):
+            message = Message("Message %d" % i, 1)
+            message.tags.extend(tags)
+            db.session.add(message)
+        db.session.commit()
+        expected = {
+            'Japan AND Country NOT Quote': [1],
+            'Japan Country': [1, 2],
+            'Japan OR "New York"': [1, 2, 3, 4],
+            'NOT (Japan OR Country)': [5],
+            'NOT Missing': [1, 2, 3, 4, 5],
+            'Quote OR Country AND NOT Japan': [2, 4],
+        }
+
+        def query(expression, **args):
+            response = self.client.get('/api/v1/tags/query', query_string=dict(args, q=expression))
+            return response.get_json()
+
+        bitmap = tagquery.BitMap
+        try:
+            for index, bitmap_class in [(False, bitmap), (True, bitmap), (True, None)]:
+                app.config['TAG_INDEX'] = index
+                tagquery.BitMap = bitmap_class
+                tagquery.tag_index.clear()
+                for expression, ids in expected.items():
+                    self.assertEqual(query(expression)['ids'], ids, (expression, index, bitmap_class))
+                pages = [query('Japan OR Country', page=page, per_page=2) for page in (1, 2)]
+                self.assertEqual([page['ids'] for page in pages], [[1, 2], [3, 4]])
+                self.assertEqual([page['has_more'] for page in pages], [True, False])
+        finally:
+            app.config['TAG_INDEX'] = True
+            tagquery.BitMap = bitmap
+        self.assertEqual(self.client.get('/api/v1/tags/query?q=Japan+AND').status_code, 400)
+
+        # Commits update the index in place, without reading the tags again
+        tagquery.tag_index.clear()
+        query('Japan NOT Quote')
+        message = Message("Message 5", 1)
+        message.tags.append(japan)
+        db.session.add(message)
+        second = Message.query.get(2)
+        second.tags.remove(quote)
+        db.session.delete(Message.query.get(3))
+        db.session.commit()
+        versions = tagquery.tag_index.versions
+        self.assertIsNotNone(versions)
+        self.assertEqual(query('Japan NOT Quote')['ids'], [1, 2, 6])
+        self.assertEqual(tagquery.tag_index.versions, versions)
+        # Renaming a tag clears it
+        tag = Tag.query.get(1)
+        tag.name = "Nippon"
+        db.session.commit()
+        self.assertIsNone(tagquery.tag_index.versions)
+        self.assertEqual(query('Japan OR Nippon')['ids'], [1, 2, 6])
+
+    def test_tag_query_limits(self):
+        """Ensure deep, long or large tag expressions are rejected, not crashed on"""
+        depth = tagquery.MAX_DEPTH
+        self.assertEqual(tagquery.parse('NOT ' * depth + 'Japan')[0], 'not')
+        self.assertEqual(tagquery.parse('(' * depth + 'Japan' + ')' * depth), ('tag', 'Japan'))
+        for expression in ['NOT ' * (depth + 1) + 'Japan',
+                           '(' * (depth + 1) + 'Japan' + ')' * (depth + 1),
+                           '(' * 5000, 'NOT ' * 5000 + 'Japan',
+                           ' OR '.join(['Japan'] * (tagquery.MAX_TAGS + 1)),
+                           '"%s"' % ('x' * tagquery.MAX_LENGTH)]:
+            with self.assertRaises(ValueError):
+                tagquery.parse(expression)
+            response = self.client.get('/api/v1/tags/query', query_string=dict(q=expression))
+            self.assertEqual(response.status_code, 400)
+        # The largest expressions allowed still run, in SQL and from bitmaps
+        expression = ' OR '.join(['Japan'] * tagquery.MAX_TAGS)
+        self.addCleanup(app.config.__setitem__, 'TAG_INDEX', app.config['TAG_INDEX'])
+        for index in [False, True]:
+            app.config['TAG_INDEX'] = index
+            response = self.client.get('/api/v1/tags/query', query_string=dict(q=expression))
+            self.assertEqual(response.get_json()['ids'], [])
+
+    def _query_plans(self, fn):
+        # SQLite's plan for every statement run by fn
+        statements = []
+
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        connection = db.engine.raw_connection()
+        try:
+            return [" / ".join(row[3] for row in connection.execute(
+                "EXPLAIN QUERY PLAN " + statement, parameters)) for statement, parameters in statements]
+        finally:
+            connection.close()
+
+    def test_relationship_loads_use_indexes(self):
+        """Ensure foreign key and lookup queries search indexes, not scan tables"""
+        message = Message("Hello", 1)
+        message.tags.append(Tag("Greeting"))
+        db.session.add(message)
+        db.session.commit()
+        db.session.expire_all()
+        plans = {
+            'messages.user_id': lambda: User.query.get(1).messages.all(),
+            'messages_tags.message_id': lambda: Message.query.get(1).tags,
+            'messages_tags.tag_id': lambda: Tag.query.get(1).messages,
+            'tags.name': lambda: Tag.query.filter_by(name="Greeting").all(),
+            'users.username': lambda: User.query.filter_by(username="eschoppik").first(),
+            'flask_dance_oauth.user_id': lambda: OAuth.query.filter_by(user_id=1).all(),
+        }
+        for column, fn in plans.items():
+            db.session.expire_all()
+            table, name = column.split('.')
+            plan = [p for p in self._query_plans(fn) if table in p][-1]
+            self.assertIn("USING", plan, column)
+            self.assertIn("INDEX", plan, column)
+            self.assertIn("(%s=?" % name, plan, column)
+
+    def test_tag_linked_once(self):
+        """Ensure a tag cannot be linked to the same message twice"""
+        db.session.add_all([Message("Hello", 1), Tag("Greeting")])
+        db.session.commit()
+        db.session.execute(MessageTags.insert(), {'message_id': 1, 'tag_id': 1})
+        with self.assertRaises(IntegrityError):
+            db.session.execute(MessageTags.insert(), {'message_id': 1, 'tag_id': 1})
+        db.session.rollback()
+
+    def test_migrations(self):
+        """Ensure the migrations bring a database created by an older
+        create_all up to the models"""
+        db.session.add(Message("Hello", 1))
+        db.session.add(Tag("Greeting"))
+        db.session.commit()
+        new_indexes = {'ix_messages_user_id', 'ix_messages_tags_tag_id', 'ix_tags_name',
+                       'ix_messages_tags_message_id_tag_id', 'ix_flask_dance_oauth_user_id'}
+        for name in new_indexes:
+            db.session.execute("DROP INDEX %s" % name)
+        for name in ['messages_fts_insert', 'messages_fts_delete', 'messages_fts_update']:
+            db.session.execute("DROP TRIGGER %s" % name)
+        for name in ['messages_fts', 'table_versions', 'revoked_tokens']:
+            db.session.execute("DROP TABLE %s" % name)
+        for name in ['messages', 'tags']:
+            db.session.execute("ALTER TABLE %s DROP COLUMN version" % name)
+        # A duplicate link made before links were unique
+        db.session.execute(MessageTags.insert(), [{'message_id': 1, 'tag_id': 1}] * 2)
+        db.session.commit()
+
+        def schema():
+            inspector = inspect(db.engine)
+            tables = set(inspector.get_table_names())
+            return (tables, {index['name'] for table in tables
+                             for index in inspector.get_indexes(table)},
+                    {column['name'] for column in inspector.get_columns('messages')})
+        tables, indexes, columns = schema()
+        self.assertFalse(new_indexes & indexes)
+        self.assertNotIn('version', columns)
+
+        # Migrate a separate app, the shared one is left as the tests use it
+        migrated = create_app({"SQLALCHEMY_DATABASE_URI": 'sqlite:///testing.db'})
+        Migrate(migrated, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+        self.addCleanup(db.session.execute, "DROP TABLE IF EXISTS alembic_version")
+        with migrated.app_context():
+            upgrade()
+        tables, indexes, columns = schema()
+        self.assertEqual(new_indexes & indexes, new_indexes)
+        self.assertLessEqual({'messages_fts', 'table_versions', 'revoked_tokens'}, tables)
+        self.assertIn('version', columns)
+        self.assertEqual(db.session.execute(MessageTags.count()).scalar(), 1)
+        # Existing messages are indexed for search, new ones by the triggers
+        db.session.add(Message("Hello again", 1))
+        db.session.commit()
+        self.assertEqual(search_messages("hello"), [1, 2])
+        self.assertEqual(Message.query.get(1).version, 1)
 
 if __name__ == '__main__':
     unittest.main()